@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+
+"""job handler with a large number of snippets logging a lot:
+lookup of the current snippet and detection of the end of the job.
+The source tree can be given to compare with another version:
+bench_jobhandler.py [nb_snippets] [nb_logs] [src_path]"""
+
+import os
+import sys
+import time
+import tempfile
+
+p = os.path.dirname(os.path.abspath(__file__))
+src_path = os.path.join(p, "..", "src")
+if len(sys.argv) > 3:
+    src_path = sys.argv[3]
+sys.path.insert(0, src_path)
+
+from ea.automateactions.joblibrary import jobtracer
+from ea.automateactions.joblibrary import jobhandler
+from ea.automateactions.joblibrary import jobsnippet
+from ea.automateactions.joblibrary import job
+
+NB_SNIPPETS = 1000
+NB_LOGS = 100
+
+def run_snippet(snippet):
+    """snippet logging messages like the generated code"""
+    start_time = time.time()
+    snippet.begin(description="step %s" % snippet.id)
+    for i in range(NB_LOGS):
+        job.log("message %s" % i)
+    snippet.done()
+    snippet.ending(duration=time.time() - start_time)
+    
+def bench(nb_snippets):
+    """run a job with snippets chained in groups of ten"""
+    result_path = tempfile.mkdtemp()
+    jobtracer.initialize(result_path=result_path)
+    jobhandler.initialize(globals={})
+    
+    t0 = time.perf_counter()
+    for i in range(nb_snippets):
+        when = {}
+        if i >= 10:
+            when = {"step%s" % (i - 10): "done"}
+        snippet = jobsnippet.Snippet(id=i, name="step%s" % i, when=when)
+        jobhandler.register(snippet=snippet, cb=run_snippet)
+    t_register = time.perf_counter() - t0
+    
+    t0 = time.perf_counter()
+    jobhandler.instance().start()
+    jobhandler.finalize()
+    t_run = time.perf_counter() - t0
+    
+    with open(os.path.join(result_path, "job.log")) as fh:
+        nb_lines = sum(1 for _ in fh)
+        
+    print("snippets=%s logs=%s register=%.3fs run=%.3fs "
+          "lines=%s retcode=%s" % (nb_snippets, nb_snippets * NB_LOGS,
+                                   t_register, t_run, nb_lines,
+                                   jobhandler.get_retcode()))
+    
+if __name__ == "__main__":
+    nb_snippets = NB_SNIPPETS
+    if len(sys.argv) > 1:
+        nb_snippets = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        NB_LOGS = int(sys.argv[2])
+    bench(nb_snippets=nb_snippets)
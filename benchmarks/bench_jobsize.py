@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+"""memory used by each scheduled job: job, scheduler event and
+registry entries. The source tree can be given to compare with
+another version of the server: bench_jobsize.py [nb_jobs] [src_path]"""
+
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+p = os.path.dirname(os.path.abspath(__file__))
+src_path = os.path.join(p, "..", "src")
+if len(sys.argv) > 2:
+    src_path = sys.argv[2]
+sys.path.insert(0, src_path)
+
+from ea.automateactions.serversystem import logger
+from ea.automateactions.serversystem import scheduler
+from ea.automateactions.serverengine import constant
+from ea.automateactions.serverengine import jobprocess
+from ea.automateactions.serverengine import jobsregistry
+
+NB_JOBS = 20000
+
+# a typical action with some snippets
+JOB_DESCR = "\n".join( [ "snippets:" ] + 
+                       [ "  - step%s:\n      description: step %s\n"
+                         "      execute: code/action%s.yml" % (i, i, i)
+                         for i in range(20) ] )
+
+class Manager():
+    """callback of the events"""
+    def execute_job(self, job):
+        """nothing to do"""
+        pass
+        
+def bench(nb_jobs):
+    """schedule the jobs like the jobs manager"""
+    mngr = Manager()
+    sched = scheduler.SchedulerThread(engine=scheduler.ENGINE_INDEXED)
+    registry = jobsregistry.JobsRegistry()
+    now = time.time()
+    
+    tracemalloc.start()
+    mem_start, _ = tracemalloc.get_traced_memory()
+    for i in range(nb_jobs):
+        # new objects for each request, like after the json decoding
+        job = jobprocess.Job(job_mngr=mngr,
+                             job_descr="".join(list(JOB_DESCR)),
+                             job_file=None,
+                             workspace="".join(list("common")),
+                             sched_mode=constant.SCHED_EVERY_X,
+                             sched_at=[0, 0, 0, 0, 0, 60],
+                             user={"login": "admin", "role": "admin"})
+        job.sched_timestamp = now + 3600 + i
+        _, event = sched.add_event(job.job_id, job.sched_timestamp,
+                                   mngr.execute_job, job)
+        job.set_event(event=event)
+        registry.add(job=job)
+    mem_end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    print("jobs=%s total=%.1fMB bytes-per-job=%.0f" % (nb_jobs,
+                                                       (mem_end - mem_start) / 1024 / 1024,
+                                                       (mem_end - mem_start) / nb_jobs))
+
+if __name__ == "__main__":
+    nb_jobs = NB_JOBS
+    if len(sys.argv) > 1:
+        nb_jobs = int(sys.argv[1])
+        
+    log_file = os.path.join(tempfile.gettempdir(), "bench_jobsize.log")
+    logger.initialize(log_file=log_file, level="ERROR",
+                      max_size="5M", nb_files=1)
+                      
+    bench(nb_jobs=nb_jobs)
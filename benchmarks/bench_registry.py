@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+"""memory benchmark of the jobs registry and the executions storage:
+run a large number of jobs through their lifecycle with Job.set_state,
+the statuses are saved in a temporary folder, and report the RSS of 
+the process: bench_registry.py [nb_jobs]"""
+
+import os
+import sys
+import shutil
+import tempfile
+import resource
+
+p = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(p, "..", "src"))
+
+from ea.automateactions.serversystem import logger
+from ea.automateactions.serversystem import settings
+from ea.automateactions.serverengine import constant
+from ea.automateactions.serverengine import jobprocess
+from ea.automateactions.serverengine import jobsmanager
+from ea.automateactions.serverstorage import executionstorage
+
+NB_JOBS = 1000000
+
+# the legacy list and the unlimited cache keep every 
+# job, limit the number of jobs to keep the memory usage reasonable
+NB_JOBS_LIST = 100000
+
+CACHE_SIZE = 10000
+
+USER = {"login": "admin", "role": "admin"}
+
+JOB_DESCR = "python: |\n  from ea.automateactions.joblibrary import job\n  job.log('hello')"
+
+def get_rss():
+    """current resident memory in MB"""
+    try:
+        with open("/proc/self/statm") as fh:
+            pages = int(fh.read().split()[1])
+        return pages * resource.getpagesize() / 1024 / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        
+class ListRegistry():
+    """legacy registry, a plain list never cleaned"""
+    def __init__(self):
+        """class init"""
+        self.jobs = []
+        
+    def add(self, job):
+        """add job"""
+        self.jobs.append(job)
+        
+    def update(self, job, old_state):
+        """nothing to do"""
+        pass
+        
+    def __len__(self):
+        """number of jobs"""
+        return len(self.jobs)
+        
+def bench(name, registry, cache_size, nb_jobs):
+    """run the jobs through the registry and the executions storage"""
+    repo_path = tempfile.mkdtemp()
+    executionstorage.initialize(repo_path=repo_path, cache_size=cache_size)
+    job_mngr = jobsmanager.JobsManager(path_bckps=repo_path)
+    if registry is not None:
+        job_mngr.jobs = registry
+        
+    rss_start = get_rss()
+    checkpoints = []
+    for i in range(nb_jobs):
+        job = jobprocess.Job(job_mngr=job_mngr,
+                             job_descr=JOB_DESCR,
+                             job_file=None,
+                             workspace="common",
+                             sched_mode=constant.SCHED_NOW,
+                             sched_at=(0, 0, 0, 0, 0, 0),
+                             user=USER)
+        job.init()
+        job_mngr.jobs.add(job)
+        
+        # the status is saved on each change, 
+        # the terminated job is evicted
+        job.set_state(state=constant.STATE_RUNNING)
+        job.set_state(state=constant.STATE_SUCCESS)
+            
+        if (i + 1) % (nb_jobs // 10) == 0:
+            checkpoints.append("%.0f" % get_rss())
+        
+    print("%-8s jobs=%s registered=%s cached=%s rss-start=%.0fMB "
+          "rss-checkpoints(MB)=%s" % (name, nb_jobs, len(job_mngr.jobs),
+                                      len(executionstorage.instance().cache),
+                                      rss_start, ",".join(checkpoints)))
+                                      
+    executionstorage.finalize()
+    shutil.rmtree(repo_path)
+
+if __name__ == "__main__":
+    nb_jobs = NB_JOBS
+    if len(sys.argv) > 1:
+        nb_jobs = int(sys.argv[1])
+        
+    settings.initialize()
+    log_file = os.path.join(tempfile.gettempdir(), "bench_registry.log")
+    logger.initialize(log_file=log_file, level="ERROR",
+                      max_size="5M", nb_files=1)
+                      
+    bench(name="registry", registry=None, cache_size=CACHE_SIZE,
+          nb_jobs=nb_jobs)
+    bench(name="list", registry=ListRegistry(), cache_size=0,
+          nb_jobs=min(nb_jobs, NB_JOBS_LIST))
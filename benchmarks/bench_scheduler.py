@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+"""benchmark of the scheduler engines: schedule, reschedule 
+and cancel a large number of events"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+p = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(p, "..", "src"))
+
+from ea.automateactions.serversystem import logger
+from ea.automateactions.serversystem import scheduler
+
+NB_EVENTS = 100000
+
+# the legacy heap engine is quadratic on cancel, 
+# limit the number of events to keep the run short
+NB_EVENTS_HEAP = 10000
+
+def callback():
+    """dummy callback"""
+    pass
+
+def bench(engine, nb_events):
+    """run the benchmark for one engine"""
+    sched = scheduler.SchedulerThread(engine=engine)
+    now = time.time()
+    
+    t0 = time.perf_counter()
+    events = []
+    for i in range(nb_events):
+        ts = now + 3600 + random.random() * 86400
+        _, event = sched.add_event(i, ts, callback)
+        events.append(event)
+    t_add = time.perf_counter() - t0
+
+    # reschedule 10% of the events
+    t0 = time.perf_counter()
+    for event in random.sample(events, nb_events // 10):
+        sched.update_event(event, event.timestamp + 60)
+    t_update = time.perf_counter() - t0
+    
+    # cancel all events in random order
+    random.shuffle(events)
+    t0 = time.perf_counter()
+    for event in events:
+        sched.remove_event(event)
+    t_remove = time.perf_counter() - t0
+    
+    print("%-8s events=%s add=%.3fs update=%.3fs "
+          "cancel=%.3fs remaining=%s" % (engine, nb_events, t_add,
+                                         t_update, t_remove,
+                                         len(sched.queue)))
+
+if __name__ == "__main__":
+    nb_events = NB_EVENTS
+    if len(sys.argv) > 1:
+        nb_events = int(sys.argv[1])
+    
+    log_file = os.path.join(tempfile.gettempdir(), "bench_scheduler.log")
+    logger.initialize(log_file=log_file, level="ERROR",
+                      max_size="5M", nb_files=1)
+
+    bench(engine=scheduler.ENGINE_INDEXED, nb_events=nb_events)
+    bench(engine=scheduler.ENGINE_HEAP,
+          nb_events=min(nb_events, NB_EVENTS_HEAP))
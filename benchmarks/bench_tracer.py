@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+"""throughput of the job tracer in lines/sec, line buffered or 
+written in batches, with snippets logging from several threads 
+and print() going through the stdout writer:
+bench_tracer.py [nb_lines] [nb_threads]"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+
+p = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(p, "..", "src"))
+
+from ea.automateactions.joblibrary import jobtracer
+
+NB_LINES = 200000
+NB_THREADS = 4
+
+BUFFER_SIZE = 65536
+FLUSH_INTERVAL = 0.5
+
+def log_lines(nb_lines):
+    """log lines like the snippets"""
+    tracer = jobtracer.instance()
+    for i in range(nb_lines):
+        tracer.log_snippet_info(ref=1, message="message %s" % i)
+        
+def print_lines(nb_lines):
+    """print lines in several fragments"""
+    for i in range(nb_lines):
+        print("message", i)
+        
+def bench(name, target, nb_lines, nb_threads, buffer_size):
+    """run the benchmark for one tracer"""
+    result_path = tempfile.mkdtemp()
+    jobtracer.initialize(result_path=result_path,
+                         buffer_size=buffer_size,
+                         flush_interval=FLUSH_INTERVAL)
+    stdout = sys.stdout
+    sys.stdout = jobtracer.StdWriter()
+    
+    threads = []
+    for i in range(nb_threads):
+        t = threading.Thread(target=target, args=(nb_lines // nb_threads,))
+        threads.append(t)
+        
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    jobtracer.finalize()
+    duration = time.perf_counter() - t0
+    sys.stdout = stdout
+    
+    with open(os.path.join(result_path, "job.log")) as fh:
+        nb_written = sum(1 for _ in fh)
+        
+    print("%-8s %-6s lines=%s threads=%s duration=%.3fs "
+          "lines/sec=%.0f" % (name, target.__name__.split("_")[0],
+                              nb_written, nb_threads, duration,
+                              nb_written / duration))
+    
+if __name__ == "__main__":
+    nb_lines = NB_LINES
+    if len(sys.argv) > 1:
+        nb_lines = int(sys.argv[1])
+    nb_threads = NB_THREADS
+    if len(sys.argv) > 2:
+        nb_threads = int(sys.argv[2])
+        
+    for target in (log_lines, print_lines):
+        bench(name="line", target=target, nb_lines=nb_lines,
+              nb_threads=nb_threads, buffer_size=0)
+        bench(name="buffered", target=target, nb_lines=nb_lines,
+              nb_threads=nb_threads, buffer_size=BUFFER_SIZE)
@@ -1,13 +1,18 @@
-import threading
 import re
+import multiprocessing
 
 from ea.automateactions.joblibrary import jobhandler
 
 class JobCache():
-    """job cache"""
-    def __init__(self):
+    """job cache, shared with the snippets run in child processes
+    through a manager when shared"""
+    def __init__(self, shared=False):
         """init class"""
+        self._manager = None
         self._cache = {}
+        if shared and "fork" in multiprocessing.get_all_start_methods():
+            self._manager = multiprocessing.get_context("fork").Manager()
+            self._cache = self._manager.dict()
 
     def capture(self, data, regexp):
         """capture data  and save it in cache"""
@@ -22,6 +27,8 @@ class JobCache():
         
     def all(self):
         """return cache content"""
+        if self._manager is not None:
+            return self._cache.copy()
         return self._cache
         
     def get(self, name, default=None):
@@ -34,8 +41,7 @@ class JobCache():
         
     def reset(self):
         """reset the cache"""
-        del self._cache
-        self._cache = {}
+        self._cache.clear()
         
 JobCacheIns = None
 
@@ -45,16 +51,14 @@ def instance():
     if JobCacheIns:
         return JobCacheIns
 
-def initialize():
+def initialize(shared=False):
     """init"""
     global JobCacheIns
-    JobCacheIns = JobCache()
+    JobCacheIns = JobCache(shared=shared)
 
 
 def find_snippet():
-    t = threading.currentThread().getName()
-    snippet = jobhandler.instance().get_snippet_by_thread(thread_name=t)
-    return snippet
+    return jobhandler.get_current_snippet()
 
 def subtitute(current_value, regex, new_value):
     matched = re.findall(regex, current_value)
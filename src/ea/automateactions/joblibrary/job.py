@@ -1,14 +1,11 @@
 
-import threading 
 import time
 
 from ea.automateactions.joblibrary import jobhandler
 from ea.automateactions.joblibrary import jobtracer
 
 def find_snippet():
-    t = threading.currentThread().getName()
-    action = jobhandler.instance().get_snippet_by_thread(thread_name=t)
-    return action
+    return jobhandler.get_current_snippet()
     
 def log(message):
     """log message"""
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+import os
+import sys
+import ast
+import time
+import marshal
+import linecache
+import traceback
+
+from ea.automateactions.joblibrary import jobsnippet
+
+SPACE = " " * 4
+
+def get_bundle_name():
+    """name of the precompiled file for the running interpreter"""
+    return "jobbundle.%s.bin" % sys.implementation.cache_tag
+    
+def compile_snippet(source, filename):
+    """compile the source of a snippet as a run_snippet_code function,
+    line numbers in tracebacks match the lines of the snippet source"""
+    lines = [ "%s%s" % (SPACE, line) for line in source.splitlines() ]
+    try:
+        tree = ast.parse("def run_snippet_code(snippet):\n%s" % "\n".join(lines),
+                         filename=filename)
+    except SyntaxError as err:
+        err.lineno = err.lineno - 1
+        raise
+        
+    # the function definition is moved on the line zero
+    ast.increment_lineno(tree, -1)
+    return compile(tree, filename, "exec")
+    
+def save(bundle_path, sources):
+    """precompile all snippets, sources is a dict 
+    id -> (filename, source). Snippets with invalid 
+    syntax are compiled again at runtime to raise the error"""
+    codes = {}
+    for snippet_id, (filename, source) in sources.items():
+        try:
+            codes[snippet_id] = compile_snippet(source=source,
+                                                filename=filename)
+        except SyntaxError:
+            pass
+            
+    with open(os.path.join(bundle_path, get_bundle_name()), "wb") as fd:
+        marshal.dump(codes, fd)
+        
+def load(bundle_path):
+    """load precompiled snippets, empty if the bundle 
+    has been compiled by another version of python"""
+    p = os.path.join(bundle_path, get_bundle_name())
+    if not os.path.exists(p):
+        return {}
+    with open(p, "rb") as fd:
+        return marshal.load(fd)
+        
+def get_runner(snippet_id, filename, source, description, codes):
+    """return the function running the snippet in the job handler"""
+    def run_snippet(snippet):
+        step_start_time = time.time()
+        snippet.begin(description=description)
+        try:
+            # source displayed in tracebacks, indented like the 
+            # compiled code to keep the columns right
+            lines = [ "%s%s\n" % (SPACE, line) for line in source.splitlines() ]
+            linecache.cache[filename] = (len(source), None, lines, filename)
+            
+            code = codes.get(snippet_id)
+            if code is None:
+                code = compile_snippet(source=source, filename=filename)
+            
+            snippet_globals = {"__name__": "snippet%s_code" % snippet_id}
+            exec(code, snippet_globals)
+            snippet_globals["run_snippet_code"](snippet=snippet)
+            snippet.done()
+        except jobsnippet.FailureException as e:
+            snippet.error(message=e)
+        except Exception as e:
+            tb = traceback.format_exc()
+            snippet.error(message=tb)
+        step_duration = time.time() - step_start_time
+        snippet.ending(duration=step_duration)
+    return run_snippet
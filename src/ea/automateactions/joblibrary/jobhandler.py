@@ -24,14 +24,16 @@
 import time
 import threading
 import queue
+import itertools
 
 from ea.automateactions.joblibrary import jobtracer
 from ea.automateactions.serverengine import constant
 
 class JobHandler(threading.Thread):
     """job handler library"""
-    def __init__(self, globals):
-        """class init"""
+    def __init__(self, globals, max_parallel=0):
+        """class init, the snippets are started in a dedicated thread
+        or in a pool of workers with max parallel"""
         threading.Thread.__init__(self)
         self.q =  queue.Queue()
         self.e = threading.Event()
@@ -42,6 +44,30 @@ class JobHandler(threading.Thread):
         self.ret_code = constant.RETCODE_PASS
 
         self.snippets_list = []
+        
+        # snippets indexed by name, thread name and thread ident,
+        # the current snippet is also kept in the thread
+        self.snippets_names = {}
+        self.snippets_threads = {}
+        self.snippets_idents = {}
+        self.local = threading.local()
+        
+        # end of the job detected when all snippets are terminated
+        self.mutex = threading.Lock()
+        self.nb_terminated = 0
+        
+        # ready snippets run by the workers in the order of the job
+        self.max_parallel = max_parallel
+        self.ready = queue.PriorityQueue()
+        self.seq = itertools.count()
+        self.nb_busy = 0
+        self.workers = []
+        for i in range(max_parallel):
+            t = threading.Thread(target=self.work,
+                                 name="snippet-worker-%s" % i,
+                                 daemon=True)
+            t.start()
+            self.workers.append(t)
     
     def get_snippets(self):
         """return snippets list"""
@@ -49,18 +75,27 @@ class JobHandler(threading.Thread):
     
     def get_snippet(self, name):
         """get snippet instance"""
-        ret = None
-        for s in self.snippets_list:
-            if s.name == name:
-                ret = s
-                break
-        return ret
+        return self.snippets_names.get(name)
         
     def get_snippet_by_thread(self, thread_name):
         """get snippet by thread"""
-        for s in self.snippets_list:
-            if s._thread.name == thread_name:
-                return s
+        return self.snippets_threads.get(thread_name)
+        
+    def get_current_snippet(self):
+        """get the snippet running in the current thread"""
+        snippet = getattr(self.local, "snippet", None)
+        if snippet is None:
+            snippet = self.snippets_idents.get(threading.get_ident())
+        return snippet
+        
+    def set_state(self, snippet, state):
+        """change the state of the snippet, the terminated
+        snippets are counted once"""
+        with self.mutex:
+            if state == constant.SNIPPET_TERMINATED and \
+                snippet.state != constant.SNIPPET_TERMINATED:
+                self.nb_terminated += 1
+            snippet.state = state
             
     def get_retcode(self):
         """get final return code"""
@@ -78,17 +113,83 @@ class JobHandler(threading.Thread):
         """set return code to the value error"""
         self.ret_code = constant.RETCODE_ERROR
         
+    def run_snippet(self, snippet, cb):
+        """run the snippet, the snippet is kept in the thread
+        until the end, thread idents are reused"""
+        self.local.snippet = snippet
+        self.snippets_idents[threading.get_ident()] = snippet
+        try:
+            cb(snippet)
+        finally:
+            self.local.snippet = None
+            self.snippets_idents.pop(threading.get_ident(), None)
+        
     def register(self, snippet, cb):
         """register snippet"""
-        t = threading.Thread(target=cb, args=(snippet,))
-        snippet.set_thread(t=t)
+        if self.max_parallel:
+            snippet.set_callback(cb=cb)
+        else:
+            t = threading.Thread(target=self.run_snippet, args=(snippet, cb))
+            snippet.set_thread(t=t)
+            self.snippets_threads[t.name] = snippet
         
         self.snippets_list.append( snippet )
+        self.snippets_names.setdefault(snippet.name, snippet)
+        
+    def start_snippet(self, snippet):
+        """start the snippet in its thread or give it to the workers,
+        traced as queued when all workers are busy"""
+        if not self.max_parallel:
+            self.set_state(snippet=snippet, state=constant.SNIPPET_STARTED)
+            snippet._thread.start()
+            return
+            
+        # already given to the workers
+        if snippet.state != constant.SNIPPET_CREATED:
+            return
+            
+        with self.mutex:
+            busy = self.nb_busy + self.ready.qsize() >= self.max_parallel
+        if busy:
+            jobtracer.instance().log_snippet_queued(ref=snippet.id)
+        self.set_state(snippet=snippet, state=constant.SNIPPET_QUEUED)
+        self.ready.put( (snippet.id, next(self.seq), snippet) )
+        
+    def work(self):
+        """worker loop, run the ready snippets"""
+        while True:
+            _, _, snippet = self.ready.get()
+            if snippet is None:
+                break
+                
+            # cancelled while waiting
+            if snippet.state == constant.SNIPPET_TERMINATED:
+                continue
+                
+            with self.mutex:
+                self.nb_busy += 1
+            self.set_state(snippet=snippet, state=constant.SNIPPET_STARTED)
+            try:
+                self.run_snippet(snippet, snippet._cb)
+            finally:
+                with self.mutex:
+                    self.nb_busy -= 1
 
     def stop(self):
-        """stop thread"""
+        """stop thread and workers"""
         self.r = False
+        for _ in self.workers:
+            self.ready.put( (float("inf"), next(self.seq), None) )
 
+    def join_snippets(self):
+        """wait the end of the snippet threads and workers,
+        the snippets are terminated before their last lines"""
+        for snippet in self.snippets_list:
+            if snippet._thread is not None and snippet._thread.is_alive():
+                snippet._thread.join()
+        for t in self.workers:
+            t.join()
+            
     def enqueue_event(self, snippet):
         """add event in queue"""
         self.q.put(snippet)
@@ -111,11 +212,7 @@ class JobHandler(threading.Thread):
                         event["snippet"].trigger(msg=event["msg"])
                         
                 # no more snippets to execute ?
-                score = 0
-                for snippet in self.snippets_list:
-                    score += snippet.state
-
-                if score == len(self.snippets_list) * 2:
+                if self.nb_terminated == len(self.snippets_list):
                     self.stop()
                     
                 self.e.clear()
@@ -135,6 +232,10 @@ def get_snippet(name):
     """get snippet instance"""
     return instance().get_snippet(name=name)
     
+def get_current_snippet():
+    """get the snippet of the current thread"""
+    return instance().get_current_snippet()
+    
 def get_retcode():
     """get return code"""
     return instance().get_retcode()
@@ -156,8 +257,9 @@ def instance():
 def finalize():
     """finalize"""
     instance().join()
+    instance().join_snippets()
     
-def initialize(globals):
+def initialize(globals, max_parallel=0):
     """init"""
     global JobHdl
-    JobHdl = JobHandler(globals=globals)
+    JobHdl = JobHandler(globals=globals, max_parallel=max_parallel)
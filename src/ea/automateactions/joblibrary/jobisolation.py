@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+import queue
+import threading
+import traceback
+import multiprocessing
+import concurrent.futures
+
+from ea.automateactions.joblibrary import jobtracer
+from ea.automateactions.joblibrary import jobhandler
+
+ISOLATION_THREAD = "thread"
+ISOLATION_PROCESS = "process"
+ISOLATIONS = [ ISOLATION_THREAD, ISOLATION_PROCESS ]
+
+MSG_EMIT = "emit"
+MSG_DONE = "done"
+MSG_ERROR = "error"
+
+# snippets run in a child process, id -> (snippet, callback)
+ISOLATED = {}
+
+class IsolationPool():
+    """pool of child processes forked when all snippets are
+    registered, the messages of the snippets are sent back 
+    to the job handler through a queue"""
+    def __init__(self, pool_size):
+        """class init"""
+        self.pool_size = pool_size
+        self.ctx = multiprocessing.get_context("fork")
+        self.events = self.ctx.Queue()
+        self.child = False
+        self.executor = None
+        self.listener = None
+        self.running = True
+        
+    def start(self):
+        """fork the child processes and listen the messages"""
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.pool_size,
+                                                               mp_context=self.ctx,
+                                                               initializer=init_child)
+        # the processes are forked on the first call,
+        # before the snippets are started
+        self.executor.submit(int).result()
+        
+        self.listener = threading.Thread(target=self.listen,
+                                         name="isolation-events",
+                                         daemon=True)
+        self.listener.start()
+        
+    def listen(self):
+        """apply the messages of the child processes on the snippets,
+        the queue is read until empty once stopped"""
+        while True:
+            try:
+                event = self.events.get(timeout=0.1)
+            except queue.Empty:
+                if not self.running:
+                    break
+                continue
+            snippet_id, msg, value = event
+            snippet, _ = ISOLATED[snippet_id]
+            if msg == MSG_EMIT:
+                snippet.emit(msg=value)
+            elif msg == MSG_DONE:
+                snippet.done()
+            elif msg == MSG_ERROR:
+                snippet.fail()
+                
+    def send(self, snippet, msg, value=None):
+        """send a message of the snippet to the job handler, 
+        the lines traced before are written first"""
+        jobtracer.instance().flush()
+        self.events.put( (snippet.id, msg, value) )
+        
+    def run(self, snippet):
+        """run the snippet in a child process and wait the end,
+        the lines traced before are written first"""
+        jobtracer.instance().flush()
+        try:
+            self.executor.submit(run_child, snippet.id).result()
+        except concurrent.futures.process.BrokenProcessPool:
+            snippet.error(message="child process of the snippet terminated abruptly")
+        
+    def stop(self):
+        """wait the end of the child processes, 
+        then stop the listener"""
+        self.executor.shutdown(wait=True)
+        self.running = False
+        self.listener.join()
+        
+def init_child():
+    """init of the child process"""
+    instance().child = True
+    
+    # the log is opened again by the child
+    jobtracer.reopen()
+    
+def run_child(snippet_id):
+    """run the snippet in the child process"""
+    snippet, cb = ISOLATED[snippet_id]
+    jobhandler.instance().run_snippet(snippet=snippet, cb=cb)
+    
+    # the log of the child is written before the end of the call
+    jobtracer.instance().flush()
+    
+def isolate(snippet, cb):
+    """return the callback running the snippet in a child process,
+    in a thread when fork is not available"""
+    ISOLATED[snippet.id] = (snippet, cb)
+    
+    def run_isolated(snippet):
+        if instance() is None:
+            return cb(snippet)
+        try:
+            instance().run(snippet)
+        except Exception:
+            snippet.error(message=traceback.format_exc())
+    return run_isolated
+    
+def is_child():
+    """True in the child processes"""
+    return instance() is not None and instance().child
+    
+def send(snippet, msg, value=None):
+    """send a message to the job handler"""
+    instance().send(snippet, msg, value)
+    
+IsolationIns = None
+
+def instance():
+    """Return the instance"""
+    global IsolationIns
+    return IsolationIns
+    
+def initialize(pool_size):
+    """init, not available without fork"""
+    global IsolationIns
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return
+    # set before the fork, inherited by the child processes
+    jobtracer.instance().flush()
+    IsolationIns = IsolationPool(pool_size=pool_size)
+    IsolationIns.start()
+    
+def finalize():
+    """finalize"""
+    global IsolationIns
+    if IsolationIns is not None:
+        IsolationIns.stop()
+        IsolationIns = None
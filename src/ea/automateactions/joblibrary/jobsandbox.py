@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+"""limits of the job applied in a new process before the exec of the
+job runner, the server does not run python code after the fork:
+
+    python jobsandbox.py <job runner> <limits as json> [<cgroup path>]
+"""
+
+import sys
+import os
+import json
+import traceback
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+LIMIT_CPU_TIME = "cpu-time"
+LIMIT_ADDRESS_SPACE = "address-space"
+LIMIT_OPEN_FILES = "open-files"
+LIMIT_WALL_CLOCK = "wall-clock"
+
+LIMITS = [ LIMIT_CPU_TIME, LIMIT_ADDRESS_SPACE,
+           LIMIT_OPEN_FILES, LIMIT_WALL_CLOCK ]
+
+def apply_limits(limits, cgroup_path=None):
+    """set the limits in the current process, inherited by the job"""
+    if cgroup_path is not None:
+        with open("%s/cgroup.procs" % cgroup_path, "w") as fh:
+            fh.write("%s" % os.getpid())
+    
+    if LIMIT_CPU_TIME in limits:
+        # SIGXCPU first, SIGKILL one second later
+        cpu_time = limits[LIMIT_CPU_TIME]
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_time, cpu_time + 1))
+        
+    # memory is limited by the cgroup when available
+    if LIMIT_ADDRESS_SPACE in limits and cgroup_path is None:
+        size = limits[LIMIT_ADDRESS_SPACE] * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (size, size))
+        
+    if LIMIT_OPEN_FILES in limits:
+        _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        nb_files = limits[LIMIT_OPEN_FILES]
+        if hard != resource.RLIM_INFINITY:
+            nb_files = min(nb_files, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (nb_files, nb_files))
+        
+def get_args(executable, job_runner, limits, cgroup_path=None):
+    """command line running the job runner with the limits"""
+    args = [executable, os.path.abspath(__file__), job_runner, json.dumps(limits)]
+    if cgroup_path is not None:
+        args.append(cgroup_path)
+    return args
+    
+def main():
+    """apply the limits and replace the process by the job runner"""
+    job_runner, limits = sys.argv[1], json.loads(sys.argv[2])
+    cgroup_path = sys.argv[3] if len(sys.argv) > 3 else None
+    try:
+        apply_limits(limits=limits, cgroup_path=cgroup_path)
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
+    os.execv(sys.executable, [sys.executable, job_runner])
+    
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,7 @@ import threading
 from ea.automateactions.serverengine import constant
 from ea.automateactions.joblibrary import jobtracer
 from ea.automateactions.joblibrary import jobhandler
+from ea.automateactions.joblibrary import jobisolation
 
 class FailureException(Exception):
     pass
@@ -38,6 +39,7 @@ class Snippet:
         self._retcode = constant.RETCODE_PASS
         self.id = id
         self._thread = None
+        self._cb = None
         self.name = name
         self.state = constant.SNIPPET_CREATED
         self.creation_time = time.time()
@@ -69,16 +71,17 @@ class Snippet:
             
         # init outgoing links on others snippets
         for (k, v) in when.items():
-            for act in jobhandler.get_snippets():
-                if act.name == k:
-                    d = {}
-                    d["name"] = self.name
-                    d["msg"] = v
-                    act.links_out.append(d)
+            act = jobhandler.get_snippet(name=k)
+            if act is not None:
+                d = {}
+                d["name"] = self.name
+                d["msg"] = v
+                act.links_out.append(d)
 
     def cancel(self):
         """cancel the snippet"""
-        self.state = constant.SNIPPET_TERMINATED
+        jobhandler.instance().set_state(snippet=self,
+                                        state=constant.SNIPPET_TERMINATED)
         
         # cancel the other linked snippets
         for l in self.links_out:
@@ -138,6 +141,10 @@ class Snippet:
     def set_thread(self, t):
         """set thread"""
         self._thread = t
+        
+    def set_callback(self, cb):
+        """set the callback run by the workers"""
+        self._cb = cb
 
     def start(self):
         """start the thread"""
@@ -146,9 +153,8 @@ class Snippet:
         if self.state == constant.SNIPPET_TERMINATED:
             return
             
-        # start the snippet in a thread
-        self.state = constant.SNIPPET_STARTED
-        self._thread.start()
+        # start the snippet in a thread or in the pool
+        jobhandler.instance().start_snippet(snippet=self)
      
     def notify(self, msg):
         """notify job handler"""
@@ -164,7 +170,16 @@ class Snippet:
         self._retcode = constant.RETCODE_ERROR
         jobtracer.instance().log_snippet_error(ref=self.id, message=message)
         
-        self.state = constant.SNIPPET_TERMINATED
+        if jobisolation.is_child():
+            jobisolation.send(snippet=self, msg=jobisolation.MSG_ERROR)
+            return
+        self.fail()
+        
+    def fail(self):
+        """stop the snippet on error"""
+        self._retcode = constant.RETCODE_ERROR
+        jobhandler.instance().set_state(snippet=self,
+                                        state=constant.SNIPPET_TERMINATED)
         self.notify(msg=constant.NOTIFY_FAILURE)
 
     def failure(self, message):
@@ -173,14 +188,22 @@ class Snippet:
 
     def emit(self, msg):
         """emit user message"""
+        if jobisolation.is_child():
+            jobisolation.send(snippet=self, msg=jobisolation.MSG_EMIT, value=msg)
+            return
         self.trigger(msg=msg, cancel_all=False)
 
     def done(self):
         """emit done signal"""
+        if jobisolation.is_child():
+            jobisolation.send(snippet=self, msg=jobisolation.MSG_DONE)
+            return
+            
         if self.state == constant.SNIPPET_TERMINATED:
             return
             
-        self.state = constant.SNIPPET_TERMINATED
+        jobhandler.instance().set_state(snippet=self,
+                                        state=constant.SNIPPET_TERMINATED)
         self.notify(msg=constant.NOTIFY_DONE)
             
     def begin(self, description):
@@ -21,13 +21,40 @@
 # MA 02110-1301 USA
 # -------------------------------------------------------------------
 
+import os
+import sys
+import json
 import time
+import atexit
+import signal
+import threading
+
+FORMAT_TEXT = "text"
+FORMAT_JSONL = "jsonl"
+FORMATS = [ FORMAT_TEXT, FORMAT_JSONL ]
+
+# one file per format, the format of an execution
+# is known from the file present in the folder
+LOG_FILES = { FORMAT_TEXT: "job.log",
+              FORMAT_JSONL: "job.jsonl" }
+
+# settings of the tracer given by the server to the job runner
+# at runtime, the cached builds do not depend on them
+ENV_TRACER = "EA_JOB_TRACER"
 
 class JobTracer(object):
-    """job tracer"""
-    def __init__(self, result_path):
+    """job tracer, free text or one json record per line"""
+    def __init__(self, result_path, log_format=FORMAT_TEXT, buffering=1):
         """class init"""
-        self.fd_logs = open('%s/job.log' % result_path, 'a+', 1)
+        self.log_format = log_format
+        self.fd_logs = open('%s/%s' % (result_path, LOG_FILES[log_format]),
+                            'a+', buffering)
+        self.buffer_size = 0
+        self.flush_interval = 0
+        
+        # the formatted second is cached, only the
+        # fractional part is computed for each line
+        self.second = (None, "")
 
     def get_path_log(self):
         """get path logs"""
@@ -35,82 +62,201 @@ class JobTracer(object):
         
     def get_timestamp(self):
         """Return a timestamp"""
-        return time.strftime("%H:%M:%S", time.localtime(time.time())) + \
-            ".%4.4d" % int((time.time() * 10000) % 10000)
+        now = time.time()
+        second, second_str = self.second
+        if int(now) != second:
+            second = int(now)
+            second_str = time.strftime("%H:%M:%S", time.localtime(second))
+            self.second = (second, second_str)
+        return "%s.%4.4d" % (second_str, int((now - second) * 10000))
         
     def close(self):
         """close"""
         self.fd_logs.close()
         
-    def trace(self, value):
-        """savetrace"""
-        raw_line = "%s %s\n" % (self.get_timestamp(),
-                                value)
+    def write(self, raw_line):
+        """write the line in the log"""
         self.fd_logs.write(raw_line)
         
+    def flush(self):
+        """flush the log"""
+        self.fd_logs.flush()
+        
+    def trace(self, ref, event, message=None):
+        """savetrace"""
+        if self.log_format == FORMAT_JSONL:
+            record = {"ts": round(time.time(), 4), "ref": ref, "event": event}
+            if message is not None:
+                record["msg"] = message
+            raw_line = "%s\n" % json.dumps(record)
+        else:
+            value = "%s %s" % (ref, event)
+            if message is not None:
+                value += " %s" % message
+            raw_line = "%s %s\n" % (self.get_timestamp(),
+                                    value)
+        self.write(raw_line)
+        
     def log_job_started(self):
         """job started"""
-        self.trace(value="0 job-started")
+        self.trace(ref=0, event="job-started")
         
     def log_job_stopped(self, result, duration):
         """job stopped"""
-        self.trace(value="0 job-stopped %s %.3f" % (result,
-                                                    duration) )
-        self.fd_logs.close()
+        self.trace(ref=0, event="job-stopped",
+                   message="%s %.3f" % (result, duration) )
+        self.close()
         
     def log_job_error(self, message):
         """job error"""
-        self.trace(value="0 job-error %s" % message)
+        self.trace(ref=0, event="job-error", message=message)
         
     def log_job_info(self, message):
         """job info"""
-        self.trace(value="0 job-log %s" % message)
+        self.trace(ref=0, event="job-log", message=message)
         
     def log_snippet_error(self, ref, message):
         """sniipet error"""
-        self.trace(value="%s snippet-error %s" % (ref,message) )
+        self.trace(ref=ref, event="snippet-error", message=message)
         
     def log_snippet_info(self, ref, message):
         """snippet info"""
-        self.trace(value="%s snippet-log %s" % (ref,message) )
+        self.trace(ref=ref, event="snippet-log", message=message)
 
+    def log_snippet_queued(self, ref):
+        """snippet waiting for a worker"""
+        self.trace(ref=ref, event="snippet-queued")
+        
     def log_snippet_started(self, ref, name):
         """snippet started"""
-        self.trace(value="%s snippet-begin %s" % (ref, name) )
+        self.trace(ref=ref, event="snippet-begin", message=name)
         
     def log_snippet_stopped(self, ref, result, duration):
         """snippet stopped"""
-        self.trace(value="%s snippet-ending %s %.3f" % (ref,
-                                                    result,
-                                                    duration))
+        self.trace(ref=ref, event="snippet-ending",
+                   message="%s %.3f" % (result, duration))
 
+class BufferedTracer(JobTracer):
+    """job tracer writing the lines in batches, flushed 
+    by size or interval from a background thread"""
+    def __init__(self, result_path, log_format, buffer_size, flush_interval):
+        """class init"""
+        JobTracer.__init__(self, result_path=result_path,
+                           log_format=log_format, buffering=-1)
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        
+        self.mutex = threading.Lock()
+        self.lines = []
+        self.size = 0
+        
+        self.running = True
+        self.event = threading.Event()
+        self.writer = threading.Thread(target=self.run,
+                                       name="tracer-writer",
+                                       daemon=True)
+        self.writer.start()
+        
+    def run(self):
+        """flush the lines by interval or when the buffer is full"""
+        while self.running:
+            self.event.wait(self.flush_interval)
+            self.event.clear()
+            self.flush()
+            
+    def write(self, raw_line):
+        """add the line to the buffer"""
+        with self.mutex:
+            self.lines.append(raw_line)
+            self.size += len(raw_line)
+            full = self.size >= self.buffer_size
+        if full:
+            self.event.set()
+            
+    def flush(self):
+        """write the buffered lines in the log"""
+        with self.mutex:
+            if self.fd_logs.closed:
+                return
+            if self.lines:
+                self.fd_logs.write("".join(self.lines))
+                self.lines = []
+                self.size = 0
+            self.fd_logs.flush()
+        
+    def close(self):
+        """stop the writer and flush the remaining lines"""
+        if not self.running:
+            return
+        self.running = False
+        self.event.set()
+        if threading.current_thread() is not self.writer:
+            self.writer.join()
+        self.flush()
+        self.fd_logs.close()
+        
 class StdWriter():
-    """stdout/stderr overwrite"""
+    """stdout/stderr overwrite, the partial writes 
+    are assembled in lines for each thread"""
     def __init__(self, mode_err=False):
         """init class"""
         self.mode_err=mode_err
+        self.mutex = threading.Lock()
+        self.partials = {}
         
-    def write(self, text):
-        """write"""
-        if text == "\n":
-            return
+    def log(self, text):
+        """log one line"""
         if self.mode_err:
             instance().log_job_error(message=text)
         else:
             instance().log_job_info(message=text)
             
+    def write(self, text):
+        """write"""
+        ident = threading.get_ident()
+        with self.mutex:
+            lines = (self.partials.pop(ident, "") + text).split("\n")
+            partial = lines.pop()
+            if partial:
+                self.partials[ident] = partial
+        for line in lines:
+            if line:
+                self.log(line)
+            
     def flush(self):
-        """flush"""
-        instance().fd_logs.flush()
+        """flush the partial line of the current thread"""
+        if instance() is None:
+            return
+        with self.mutex:
+            partial = self.partials.pop(threading.get_ident(), "")
+        if partial:
+            self.log(partial)
+        instance().flush()
         
     def close(self):
-        """close"""
-        instance().fd_logs.flush()
+        """flush the partial lines of all threads"""
+        if instance() is None:
+            return
+        with self.mutex:
+            partials = list(self.partials.values())
+            self.partials.clear()
+        for partial in partials:
+            self.log(partial)
+        instance().flush()
         
     def fileno(self):
         """fileno"""
         return instance().fd_logs.fileno()
  
+def get_text(record):
+    """render a json record of the log in the text format"""
+    second, fraction = divmod(int(round(record["ts"] * 10000)), 10000)
+    line = "%s.%4.4d %s %s" % (time.strftime("%H:%M:%S", time.localtime(second)),
+                               fraction, record["ref"], record["event"])
+    if "msg" in record:
+        line += " %s" % record["msg"]
+    return "%s\n" % line
+    
 TracerIns = None
 
 def get_path_log():
@@ -123,14 +269,52 @@ def instance():
     if TracerIns is not None:
         return TracerIns
 
+def on_terminate(signum, frame):
+    """flush the log before terminating the job"""
+    finalize()
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+    
+def reopen():
+    """open the log again, in a child process, the lines are
+    written directly to keep the order between the processes"""
+    initialize(result_path=os.path.dirname(get_path_log()),
+               log_format=instance().log_format)
+    
 def finalize():
     """finalize"""
     global TracerIns
     if TracerIns is not None:
+        for writer in (sys.stdout, sys.stderr):
+            if isinstance(writer, StdWriter):
+                writer.close()
         TracerIns.close()
-        del TracerIns
+        TracerIns = None
         
-def initialize(result_path):
-    """init"""
+def get_env(log_format, buffer_size, flush_interval):
+    """environment of the job runner with the settings of the tracer"""
+    tracer_settings = {"log_format": log_format,
+                       "buffer_size": buffer_size,
+                       "flush_interval": flush_interval}
+    return {ENV_TRACER: json.dumps(tracer_settings)}
+    
+def get_settings():
+    """settings of the tracer given by the server, 
+    the default ones when the runner is started by hand"""
+    return json.loads(os.environ.get(ENV_TRACER, "{}"))
+    
+def initialize(result_path, log_format=FORMAT_TEXT, buffer_size=0, flush_interval=0.5):
+    """init, the lines are written in batches with a buffer size"""
     global TracerIns
-    TracerIns = JobTracer(result_path=result_path)
+    if buffer_size:
+        TracerIns = BufferedTracer(result_path=result_path,
+                                   log_format=log_format,
+                                   buffer_size=buffer_size,
+                                   flush_interval=flush_interval)
+        
+        # the buffered lines are written before the end
+        atexit.register(finalize)
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, on_terminate)
+    else:
+        TracerIns = JobTracer(result_path=result_path, log_format=log_format)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+"""warm python worker, the job library is imported once
+and a child is forked for each job to run"""
+
+import sys
+import os
+import json
+import runpy
+import threading
+import traceback
+
+p = os.path.dirname(os.path.abspath(__file__))
+root_path = os.sep.join(p.split(os.sep)[:-3])
+sys.path.insert(0, root_path)
+
+from ea.automateactions.joblibrary import jobtracer
+from ea.automateactions.joblibrary import jobhandler
+from ea.automateactions.joblibrary import jobsnippet
+from ea.automateactions.joblibrary import datastore
+from ea.automateactions.joblibrary import jobsandbox
+
+def get_retcode(status):
+    """convert a wait status to a return code like subprocess"""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+    
+def get_resources(rusage):
+    """resources used by the child"""
+    return {"cpu-user": rusage.ru_utime,
+            "cpu-system": rusage.ru_stime,
+            "max-rss": rusage.ru_maxrss,
+            "block-in": rusage.ru_inblock,
+            "block-out": rusage.ru_oublock,
+            "ctx-voluntary": rusage.ru_nvcsw,
+            "ctx-involuntary": rusage.ru_nivcsw}
+            
+def send(event):
+    """send event to the server"""
+    sys.stdout.write("%s\n" % json.dumps(event))
+    sys.stdout.flush()
+
+def run_job(job_path, err_path, env, limits, cgroup_path, sync_fd):
+    """run the job runner in the forked child, never returns"""
+    # own process group, killed with the job, 
+    # the server is notified once created
+    os.setsid()
+    os.write(sync_fd, b"1")
+    os.close(sync_fd)
+    os.environ.update(env)
+    
+    # stdout is not used by the job, stderr is saved in a file
+    null_fd = os.open(os.devnull, os.O_RDWR)
+    os.dup2(null_fd, 0)
+    os.dup2(null_fd, 1)
+    err_fd = os.open(err_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.dup2(err_fd, 2)
+    
+    try:
+        jobsandbox.apply_limits(limits=limits, cgroup_path=cgroup_path)
+    except Exception:
+        traceback.print_exc()
+        sys.stderr.flush()
+        os._exit(1)
+        
+    job_runner = os.path.join(job_path, "jobrunner.py")
+    sys.argv = [job_runner]
+    sys.path.insert(0, job_path)
+
+    ret_code = 0
+    try:
+        runpy.run_path(job_runner, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            ret_code = 0
+        elif isinstance(e.code, int):
+            ret_code = e.code
+        else:
+            ret_code = 1
+    except BaseException:
+        traceback.print_exc()
+        ret_code = 1
+    
+    # wait the end of the snippets like the interpreter does on exit,
+    # the daemon threads are not waited
+    for t in threading.enumerate():
+        if t is not threading.main_thread() and not t.daemon:
+            t.join()
+            
+    # the atexit functions are not called with os._exit, 
+    # the buffered log is written now
+    try:
+        jobtracer.finalize()
+    except Exception:
+        traceback.print_exc()
+        
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    except Exception:
+        pass
+    os._exit(ret_code)
+    
+def main():
+    """read jobs to run from stdin, one json request per line"""
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        
+        req = json.loads(line)
+        
+        # the job is started once in its own process group,
+        # killed with the group from the server
+        sync_r, sync_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(sync_r)
+            run_job(job_path=req["job-path"], err_path=req["err-path"],
+                    env=req["env"], limits=req["limits"], cgroup_path=req["cgroup-path"],
+                    sync_fd=sync_w)
+            
+        os.close(sync_w)
+        os.read(sync_r, 1)
+        os.close(sync_r)
+        send({"event": "started", "pid": pid})
+        _, status, rusage = os.wait4(pid, 0)
+        send({"event": "exited", "pid": pid,
+              "retcode": get_retcode(status),
+              "resources": get_resources(rusage)})
+        
+if __name__ == "__main__":
+    main()
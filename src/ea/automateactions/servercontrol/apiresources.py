@@ -28,6 +28,8 @@ from pycnic.errors import HTTP_401, HTTP_400, HTTP_500, HTTP_403
 
 from ea.automateactions.serversystem import logger
 from ea.automateactions.serversystem import settings
+from ea.automateactions.serversystem import dispatcher
+from ea.automateactions.serversystem import metrics
 from ea.automateactions.serverengine import constant
 from ea.automateactions.serverengine import jobsmanager
 from ea.automateactions.serverengine import workspacesmanager
@@ -37,6 +39,7 @@ from ea.automateactions.serverengine import usersmanager
 from ea.automateactions.serverstorage import actionstorage
 from ea.automateactions.serverstorage import snippetstorage
 from ea.automateactions.serverstorage import executionstorage
+from ea.automateactions.serverstorage import buildstorage
            
 def get_user(request):
     """Lookup a user session"""
@@ -395,14 +398,20 @@ class JobsHandler(Handler):
         yaml_file = self.request.data.get("yaml-file")
         yaml_content = self.request.data.get("yaml-content")
         if yaml_file is None and yaml_content is None:
-            raise EmptyValue("yaml content or file is expected")
+            raise HTTP_400("yaml content or file is expected")
         
         workspace = self.request.data.get("workspace", "common")
         sched_mode = self.request.data.get("mode", 0)
         sched_at = self.request.data.get("schedule-at", (0, 0, 0, 0, 0, 0) )
+        async_mode = self.request.data.get("async", 
+                                           settings.cfg["jobs"]["async-submit"])
+        spread = self.request.data.get("spread")
 
         if sched_mode not in constant.SCHED_MODE:
             raise HTTP_400("invalid sched mode")
+        if spread is not None:
+            if not isinstance(spread, int) or spread < 0:
+                raise HTTP_400("invalid spread window")
             
         success, details = jobsmanager.schedule_job(
                                                     user=user_profile,
@@ -411,7 +420,11 @@ class JobsHandler(Handler):
                                                     workspace=workspace,
                                                     sched_mode=sched_mode,
                                                     sched_at=sched_at,
+                                                    async_mode=async_mode,
+                                                    spread=spread
                                                 )
+        if success in [constant.NOT_FOUND, constant.FAILED]:
+            raise HTTP_400(details)
         if success != constant.OK:
             raise HTTP_500(details)
             
@@ -435,6 +448,48 @@ class JobsHandler(Handler):
         """cors support"""
         return {}
      
+class DispatcherHandler(Handler):
+    """Dispatcher handler for rest requests"""
+    def get(self):
+        """return stats of the dispatch pool"""
+        user_profile = get_user(request=self.request)
+
+        return {"cmd": self.request.path,
+                "dispatcher": dispatcher.get_stats()}
+                
+    def options(self, id=None):
+        """cors support"""
+        return {}
+        
+class MetricsHandler(Handler):
+    """Metrics handler for rest requests"""
+    def get(self):
+        """return histograms of the scheduler and jobs latencies"""
+        user_profile = get_user(request=self.request)
+
+        return {"cmd": self.request.path,
+                "metrics": metrics.get_stats()}
+                
+    def options(self, id=None):
+        """cors support"""
+        return {}
+        
+class BuildsHandler(Handler):
+    """Build cache handler for rest requests"""
+    def get(self):
+        """return stats of the build cache"""
+        user_profile = get_user(request=self.request)
+
+        if buildstorage.instance() is None:
+            raise HTTP_400("build cache disabled")
+            
+        return {"cmd": self.request.path,
+                "builds": buildstorage.get_stats()}
+                
+    def options(self, id=None):
+        """cors support"""
+        return {}
+        
 class ExecutionsHandler(Handler):
     """History handler for rest requests"""   
     def get(self, id=None):
@@ -453,6 +508,29 @@ class ExecutionsHandler(Handler):
                 raise HTTP_500(details)
             rsp.update(details)
             
+            # events of one snippet or a range of lines of the json log
+            events_args = {}
+            for arg in ("snippet_id", "line_start", "line_end"):
+                if arg not in self.request.args:
+                    continue
+                try:
+                    events_args[arg] = int(self.request.args.get(arg))
+                except ValueError:
+                    raise HTTP_400("bad %s provided" % arg)
+                if events_args[arg] < 0:
+                    raise HTTP_400("bad %s provided" % arg)
+                    
+            if events_args:
+                success, details = executionstorage.get_events(job_id=id,
+                                                               user=user_profile,
+                                                               **events_args)
+                if success == constant.FAILED:
+                    raise HTTP_400(details)
+                if success != constant.OK:
+                    raise HTTP_500(details)
+                rsp.update(details)
+                return rsp
+                
             success, details = executionstorage.get_logs(job_id=id,
                                                     user=user_profile,
                                                     index=log_index)
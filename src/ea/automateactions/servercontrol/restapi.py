@@ -67,6 +67,9 @@ class WebServices(WSGI):
         ('/v1/workspaces/(.*)' , apiresources.WorkspacesHandler()),
         ('/v1/jobs', apiresources.JobsHandler()),
         ('/v1/jobs/(%s)' % uuid_regex, apiresources.JobsHandler()),
+        ('/v1/dispatcher', apiresources.DispatcherHandler()),
+        ('/v1/metrics', apiresources.MetricsHandler()),
+        ('/v1/builds', apiresources.BuildsHandler()),
         ('/v1/executions', apiresources.ExecutionsHandler()),
         ('/v1/executions/(%s)' % uuid_regex, apiresources.ExecutionsHandler()),
         ('/v1/actions', apiresources.ActionsHandler()),
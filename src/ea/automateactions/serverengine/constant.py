@@ -40,14 +40,18 @@ FAILED = 400
 OK = 200
 ALREADY_EXISTS = 412
 
+STATE_PREPARING = 'PREPARING'
 STATE_WAITING = 'WAITING'
+STATE_QUEUED = 'QUEUED'
 STATE_RUNNING = 'RUNNING'
 STATE_FAILURE = 'FAILURE'
 STATE_SUCCESS = 'SUCCESS'
+STATE_TIMEOUT = 'TIMEOUT'
 
 SNIPPET_CREATED = 0
 SNIPPET_STARTED = 1
 SNIPPET_TERMINATED = 2
+SNIPPET_QUEUED = 3
 
 NOTIFY_START = "start"
 NOTIFY_DONE = "done"
@@ -67,6 +71,7 @@ SCHED_HOURLY = 2
 SCHED_DAILY = 3
 SCHED_WEEKLY = 4
 SCHED_EVERY_X = 5
+SCHED_CRON = 6
 
 SCHED_MODE = [
                 SCHED_NOW,
@@ -74,5 +79,6 @@ SCHED_MODE = [
                 SCHED_HOURLY,
                 SCHED_DAILY,
                 SCHED_WEEKLY,
-                SCHED_EVERY_X
+                SCHED_EVERY_X,
+                SCHED_CRON
              ]
\ No newline at end of file
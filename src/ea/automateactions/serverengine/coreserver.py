@@ -32,16 +32,23 @@ from ea.automateactions.serversystem import daemon
 from ea.automateactions.serversystem import logger
 from ea.automateactions.serversystem import settings
 from ea.automateactions.serversystem import scheduler
+from ea.automateactions.serversystem import dispatcher
+from ea.automateactions.serversystem import supervisor
+from ea.automateactions.serversystem import metrics
 from ea.automateactions.serverengine import jobsmanager
+from ea.automateactions.serverengine import jobworkers
 from ea.automateactions.serverengine import workspacesmanager
 from ea.automateactions.serverengine import globalsmanager
 from ea.automateactions.serverengine import sessionsmanager
 from ea.automateactions.serverengine import usersmanager
+from ea.automateactions.joblibrary import jobtracer
 from ea.automateactions.servercontrol import cliserver
 from ea.automateactions.servercontrol import restapi
 from ea.automateactions.serverstorage import executionstorage
 from ea.automateactions.serverstorage import actionstorage
 from ea.automateactions.serverstorage import snippetstorage
+from ea.automateactions.serverstorage import buildstorage
+from ea.automateactions.serverstorage import journalstorage
 
 n = os.path.normpath
 
@@ -51,6 +58,8 @@ path_backups = "%s/%s/" % (settings.get_app_path(),
                            settings.cfg['paths']['jobs-backups'])                   
 path_results = '%s/%s/' % (settings.get_app_path(),
                           settings.cfg['paths']['jobs-executions']) 
+path_builds = '%s/%s/' % (settings.get_app_path(),
+                          settings.cfg['paths']['jobs-builds']) 
 path_workspaces = "%s/%s/" % (settings.get_app_path(),
                               settings.cfg['paths']['workspaces'])  
 path_snippets = "%s/%%s/snippets/" % path_workspaces
@@ -86,10 +95,16 @@ class DaemonServer(daemon.Daemon):
         sessionsmanager.finalize()
         
         scheduler.finalize()
+        dispatcher.finalize()
         jobsmanager.finalize()
+        jobworkers.finalize()
+        supervisor.finalize()
         actionstorage.finalize()
         snippetstorage.finalize()
         executionstorage.finalize()
+        buildstorage.finalize()
+        journalstorage.finalize()
+        metrics.finalize()
         restapi.finalize()
 
         cliserver.finalize()
@@ -125,15 +140,65 @@ class DaemonServer(daemon.Daemon):
             sessionsmanager.initialize()
             logger.info("coreserver - sessions manager [OK]")
             
-            scheduler.initialize()
+            metrics.initialize(log_interval=settings.cfg['metrics']['log-interval'])
+            logger.info("coreserver - metrics [OK]")
+            
+            dispatcher.initialize(max_workers=settings.cfg['dispatcher']['max-workers'],
+                                  max_queue=settings.cfg['dispatcher']['max-queue'],
+                                  fair=settings.cfg['dispatcher']['fair-queuing'])
+            dispatcher.set_weights(weights=workspacesmanager.get_weights())
+            logger.info("coreserver - dispatcher [OK]")
+            
+            if settings.cfg['scheduler']['catch-up'] not in scheduler.CATCH_UP_POLICIES:
+                raise Exception("unknown catch-up policy: %s" % settings.cfg['scheduler']['catch-up'])
+            scheduler.initialize(engine=settings.cfg['scheduler']['engine'],
+                                 max_sleep=settings.cfg['scheduler']['max-sleep'])
             logger.info("coreserver - scheduler [OK]")
             
-            jobsmanager.initialize(path_bckps=n(path_backups))
+            metrics.register(name="scheduler", get_stats=scheduler.get_stats)
+            metrics.register(name="dispatcher", get_stats=dispatcher.get_stats)
+            
+            journalstorage.initialize(repo_path=n(path_backups),
+                                      flush_interval=settings.cfg['journal']['flush-interval'],
+                                      compact_min=settings.cfg['journal']['compact-min'])
+            logger.info("coreserver - jobs journal [OK]")
+            
+            jobsmanager.initialize(path_bckps=n(path_backups),
+                                   prepare_workers=settings.cfg['jobs']['prepare-workers'],
+                                   prepare_queue=settings.cfg['jobs']['prepare-queue'])
             logger.info("coreserver - jobs manager [OK]")
             
-            executionstorage.initialize(repo_path=n(path_results))
+            metrics.register(name="jobs", get_stats=jobsmanager.get_stats)
+            
+            # child processes are waited from one event loop,
+            # jobs are waited in a thread on windows
+            if platform.system() != "Windows":
+                supervisor.initialize(poll_interval=settings.cfg['supervisor']['poll-interval'])
+                logger.info("coreserver - process supervisor [OK]")
+                
+                metrics.register(name="supervisor", get_stats=supervisor.get_stats)
+                
+            # warm workers rely on fork, not available on windows
+            if settings.cfg['executor']['mode'] == jobworkers.MODE_PREFORK \
+                and platform.system() != "Windows":
+                jobworkers.initialize(executable=settings.cfg['paths']['python-linux'],
+                                      pool_size=settings.cfg['executor']['pool-size'],
+                                      recycle_after=settings.cfg['executor']['recycle-after'])
+                logger.info("coreserver - job workers [OK]")
+            
+            if settings.cfg['tracer']['format'] not in jobtracer.FORMATS:
+                raise Exception("unknown log format: %s" % settings.cfg['tracer']['format'])
+            executionstorage.initialize(repo_path=n(path_results),
+                                        cache_size=settings.cfg['executions']['cache-size'])
             logger.info("coreserver - executions storage [OK]")
             
+            # cache of the generated code, disabled with a size of zero
+            if settings.cfg['build']['cache-size'] > 0:
+                os.makedirs(n(path_builds), exist_ok=True)
+                buildstorage.initialize(repo_path=n(path_builds),
+                                        max_entries=settings.cfg['build']['cache-size'])
+                logger.info("coreserver - builds storage [OK]")
+            
             actionstorage.initialize(repo_path=n(path_actions))
             logger.info("coreserver - actions storage [OK]")
             
@@ -146,8 +211,10 @@ class DaemonServer(daemon.Daemon):
             restapi.start()
             logger.info("coreserver - rest api server [OK]")
             
-            jobsmanager.reload_jobs()
-            logger.info("coreserver - jobs reloaded [OK]")
+            start_time = time.time()
+            nb_jobs = jobsmanager.reload_jobs(reload_workers=settings.cfg['jobs']['reload-workers'])
+            logger.info("coreserver - %s jobs reloaded in %.3fs [OK]" % (nb_jobs,
+                                                                      time.time() - start_time))
             
         except Exception:
             tb = traceback.format_exc()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+import os
+import json
+import threading
+import collections
+
+from ea.automateactions.serversystem import logger
+from ea.automateactions.serversystem import settings
+from ea.automateactions.serverengine import constant
+
+n = os.path.normpath
+
+ADMISSION_FILE = "admission.json"
+
+MAX_ACTION = "max-action"
+MAX_WORKSPACE = "max-workspace"
+OVERLAP = "overlap"
+
+# policies when the action is already running at the max
+OVERLAP_QUEUE = "queue"
+OVERLAP_SKIP = "skip"
+OVERLAP_KILL = "kill-previous"
+OVERLAP_POLICIES = [ OVERLAP_QUEUE, OVERLAP_SKIP, OVERLAP_KILL ]
+
+# decisions of the admission
+ADMITTED = "admitted"
+QUEUED = "queued"
+SKIPPED = "skipped"
+
+def merge_policy(policy, new_policy):
+    """the most restrictive max is kept, zero is unlimited, 
+    the overlap policy is replaced"""
+    for name in [ MAX_ACTION, MAX_WORKSPACE ]:
+        try:
+            value = int(new_policy.get(name, 0))
+        except (TypeError, ValueError):
+            logger.error("jobadmission - invalid value for %s" % name)
+            continue
+        if value <= 0:
+            continue
+        if policy.get(name, 0) == 0 or value < policy[name]:
+            policy[name] = value
+            
+    if new_policy.get(OVERLAP) in OVERLAP_POLICIES:
+        policy[OVERLAP] = new_policy[OVERLAP]
+    return policy
+    
+def save_policy(job_path, max_concurrency, overlap):
+    """save the policy declared in the action with the job"""
+    if not max_concurrency and overlap is None:
+        return
+    policy = { MAX_ACTION: max_concurrency }
+    if overlap is not None:
+        policy[OVERLAP] = overlap
+    with open(n("%s/%s" % (job_path, ADMISSION_FILE)), "w") as fh:
+        fh.write(json.dumps(policy))
+        
+def get_policy(workspace, job_path):
+    """admission policy of the job, from the server configuration,
+    the workspace and the action"""
+    cfg = settings.cfg['concurrency']
+    policy = merge_policy({ OVERLAP: OVERLAP_QUEUE }, cfg)
+    
+    workspaces = cfg.get('workspaces') or {}
+    merge_policy(policy, workspaces.get(workspace, {}))
+    
+    try:
+        with open(n("%s/%s" % (job_path, ADMISSION_FILE)), "r") as fh:
+            merge_policy(policy, json.loads(fh.read()))
+    except FileNotFoundError:
+        pass
+    return policy
+    
+def get_action_key(job):
+    """jobs of the same action, identical descriptions are shared 
+    between jobs so the key is cheap to hash"""
+    return (job.workspace, job.job_file or job.job_descr)
+    
+class AdmissionQueue():
+    """running jobs counted by action and workspace, the jobs over 
+    the limits wait in the queue until a running job is terminated"""
+    def __init__(self):
+        """class init"""
+        self.mutex = threading.RLock()
+        self.running = {}
+        self.actions = {}
+        self.workspaces = {}
+        self.queue = collections.OrderedDict()
+        self.queued_actions = {}
+        self.nb_skipped = 0
+        self.nb_killed = 0
+        
+    def can_run(self, job, policy):
+        """check the limits of the action and of the workspace"""
+        max_action = policy.get(MAX_ACTION, 0)
+        if max_action and \
+            len(self.actions.get(get_action_key(job), [])) >= max_action:
+            return False
+        max_workspace = policy.get(MAX_WORKSPACE, 0)
+        if max_workspace and \
+            self.workspaces.get(job.workspace, 0) >= max_workspace:
+            return False
+        return True
+        
+    def start(self, job):
+        """count the job as running"""
+        self.running[job.job_id] = job
+        self.actions.setdefault(get_action_key(job), []).append(job)
+        self.workspaces[job.workspace] = self.workspaces.get(job.workspace, 0) + 1
+        
+    def enqueue(self, job, policy):
+        """hold the job in the queue"""
+        key = get_action_key(job)
+        self.queue[job.job_id] = (job, policy)
+        self.queued_actions[key] = self.queued_actions.get(key, 0) + 1
+        
+    def dequeue(self, job):
+        """remove the job from the queue"""
+        key = get_action_key(job)
+        del self.queue[job.job_id]
+        self.queued_actions[key] -= 1
+        if not self.queued_actions[key]:
+            del self.queued_actions[key]
+            
+    def admit(self, job, policy):
+        """admit the job or hold it in the queue according to the
+        limits, returns the decision and the running jobs to kill"""
+        with self.mutex:
+            # the runs of an action are started in order
+            if get_action_key(job) not in self.queued_actions and \
+                self.can_run(job, policy):
+                self.start(job)
+                return (ADMITTED, [])
+                
+            running = list(self.actions.get(get_action_key(job), []))
+            action_full = policy.get(MAX_ACTION, 0) and \
+                            len(running) >= policy[MAX_ACTION]
+                            
+            if action_full and policy[OVERLAP] == OVERLAP_SKIP:
+                self.nb_skipped += 1
+                return (SKIPPED, [])
+                
+            to_kill = []
+            if action_full and policy[OVERLAP] == OVERLAP_KILL:
+                to_kill = running
+                self.nb_killed += len(running)
+                
+            # set before the job can be released by another thread
+            self.enqueue(job, policy)
+            job.set_state(state=constant.STATE_QUEUED)
+            return (QUEUED, to_kill)
+            
+    def release(self, job):
+        """the job is terminated, returns the queued jobs 
+        admitted in its place"""
+        with self.mutex:
+            if self.running.pop(job.job_id, None) is None:
+                return []
+                
+            key = get_action_key(job)
+            self.actions[key].remove(job)
+            if not self.actions[key]:
+                del self.actions[key]
+            self.workspaces[job.workspace] -= 1
+            if not self.workspaces[job.workspace]:
+                del self.workspaces[job.workspace]
+                
+            admitted = []
+            for queued_job, policy in list(self.queue.values()):
+                if self.can_run(queued_job, policy):
+                    self.dequeue(queued_job)
+                    self.start(queued_job)
+                    admitted.append(queued_job)
+            return admitted
+            
+    def remove(self, job):
+        """remove the job from the queue, returns False if not queued"""
+        with self.mutex:
+            if job.job_id not in self.queue:
+                return False
+            self.dequeue(job)
+            return True
+            
+    def get_stats(self):
+        """return stats of the admission"""
+        with self.mutex:
+            return {"running": len(self.running),
+                    "queued": len(self.queue),
+                    "skipped": self.nb_skipped,
+                    "killed": self.nb_killed}
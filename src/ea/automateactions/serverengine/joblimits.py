@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+import os
+import json
+import signal
+
+from ea.automateactions.serversystem import logger
+from ea.automateactions.serversystem import settings
+from ea.automateactions.joblibrary import jobtracer
+from ea.automateactions.joblibrary import jobsandbox
+
+n = os.path.normpath
+
+LIMITS_FILE = "limits.json"
+
+# applied by the job library in the process of the job
+LIMIT_CPU_TIME = jobsandbox.LIMIT_CPU_TIME
+LIMIT_ADDRESS_SPACE = jobsandbox.LIMIT_ADDRESS_SPACE
+LIMIT_OPEN_FILES = jobsandbox.LIMIT_OPEN_FILES
+LIMIT_WALL_CLOCK = jobsandbox.LIMIT_WALL_CLOCK
+
+LIMITS = jobsandbox.LIMITS
+
+def merge_limits(limits, new_limits):
+    """the most restrictive value is kept, zero is unlimited"""
+    for name in LIMITS:
+        try:
+            value = int(new_limits.get(name, 0))
+        except (TypeError, ValueError):
+            logger.error("joblimits - invalid value for %s" % name)
+            continue
+        if value <= 0:
+            continue
+        if limits.get(name, 0) == 0 or value < limits[name]:
+            limits[name] = value
+    return limits
+    
+def save_limits(job_path, limits):
+    """save the limits declared in the action with the job"""
+    if not limits:
+        return
+    with open(n("%s/%s" % (job_path, LIMITS_FILE)), "w") as fh:
+        fh.write(json.dumps(limits))
+        
+def get_limits(workspace, job_path):
+    """limits of the job, from the server configuration,
+    the workspace and the action"""
+    limits = merge_limits({}, settings.cfg['limits'])
+    
+    workspaces = settings.cfg['limits'].get('workspaces') or {}
+    merge_limits(limits, workspaces.get(workspace, {}))
+    
+    try:
+        with open(n("%s/%s" % (job_path, LIMITS_FILE)), "r") as fh:
+            merge_limits(limits, json.loads(fh.read()))
+    except FileNotFoundError:
+        pass
+    return limits
+    
+def create_cgroup(job_id, limits):
+    """create a cgroup v2 for the job under the configured 
+    sub-tree, returns None when cgroups are not used"""
+    parent_path = settings.cfg['limits'].get('cgroup-path')
+    if not parent_path or not limits:
+        return None
+        
+    cgroup_path = n("%s/%s" % (parent_path, job_id))
+    try:
+        os.mkdir(cgroup_path)
+        if LIMIT_ADDRESS_SPACE in limits:
+            size = limits[LIMIT_ADDRESS_SPACE] * 1024 * 1024
+            with open("%s/memory.max" % cgroup_path, "w") as fh:
+                fh.write("%s" % size)
+            with open("%s/memory.swap.max" % cgroup_path, "w") as fh:
+                fh.write("0")
+    except OSError as e:
+        logger.error("joblimits - unable to create cgroup: %s" % e)
+        remove_cgroup(cgroup_path=cgroup_path)
+        return None
+    return cgroup_path
+    
+def remove_cgroup(cgroup_path):
+    """remove the cgroup of the job"""
+    if cgroup_path is None:
+        return
+    try:
+        os.rmdir(cgroup_path)
+    except OSError as e:
+        logger.error("joblimits - unable to remove cgroup: %s" % e)
+        
+def get_oom_kills(cgroup_path):
+    """number of processes killed by the memory limit"""
+    try:
+        with open("%s/memory.events" % cgroup_path, "r") as fh:
+            for line in fh:
+                name, value = line.split()
+                if name == "oom_kill":
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+    return 0
+    
+def read_errors(job_path, err_str):
+    """errors of the job, the snippets errors are only in the log"""
+    for log_file in jobtracer.LOG_FILES.values():
+        try:
+            with open(n("%s/%s" % (job_path, log_file)), "rb") as fh:
+                fh.seek(0, os.SEEK_END)
+                fh.seek(max(0, fh.tell() - 65536))
+                return err_str + fh.read().decode("utf8", errors="replace")
+        except OSError:
+            pass
+    return err_str
+        
+def get_breaches(limits, retcode, resources, err_str, job_path, cgroup_path):
+    """limits exceeded by the job according to the end of the process"""
+    breaches = []
+    
+    if retcode != 0 and (LIMIT_ADDRESS_SPACE in limits or LIMIT_OPEN_FILES in limits):
+        err_str = read_errors(job_path=job_path, err_str=err_str)
+    
+    if LIMIT_CPU_TIME in limits:
+        cpu_time = 0
+        if resources is not None:
+            cpu_time = resources["cpu-user"] + resources["cpu-system"]
+        if retcode == -signal.SIGXCPU or cpu_time >= limits[LIMIT_CPU_TIME]:
+            breaches.append(LIMIT_CPU_TIME)
+            
+    if LIMIT_ADDRESS_SPACE in limits:
+        if cgroup_path is not None and get_oom_kills(cgroup_path):
+            breaches.append(LIMIT_ADDRESS_SPACE)
+        elif "MemoryError" in err_str:
+            breaches.append(LIMIT_ADDRESS_SPACE)
+            
+    if LIMIT_OPEN_FILES in limits:
+        if "Too many open files" in err_str:
+            breaches.append(LIMIT_OPEN_FILES)
+            
+    return breaches
@@ -31,12 +31,20 @@ from ea.automateactions.serverengine import constant
 from ea.automateactions.serverengine import workspacesmanager
 from ea.automateactions.serverengine import usersmanager
 from ea.automateactions.serverengine import globalsmanager
+from ea.automateactions.serverengine import joblimits
+from ea.automateactions.serverengine import jobadmission
+from ea.automateactions.joblibrary import jobisolation
 from ea.automateactions.serverstorage import actionstorage
 from ea.automateactions.serverstorage import snippetstorage
 from ea.automateactions.serverstorage import executionstorage
+from ea.automateactions.serverstorage import buildstorage
+from ea.automateactions.joblibrary import jobbundle
 
 n = os.path.normpath
 
+OUTPUT_FILES = "files"
+OUTPUT_BUNDLE = "bundle"
+
     
 def load_yamlstr(yaml_str):
     """open and read yaml string"""
@@ -55,6 +63,19 @@ def load_yamlfile(yaml_file, workspace, user, repo):
     """load yaml file"""
     logger.debug('jobmodel - loading yaml from file')
     
+    success, yaml_str = read_yamlfile(yaml_file=yaml_file,
+                                      workspace=workspace,
+                                      user=user,
+                                      repo=repo)
+    if success != constant.OK:
+        return (success, yaml_str)
+    
+    return load_yamlstr(yaml_str=yaml_str)
+    
+def read_yamlfile(yaml_file, workspace, user, repo):
+    """read yaml file without loading it"""
+    logger.debug('jobmodel - reading yaml file')
+    
     if repo == constant.REPO_ACTIONS:
         repo_path = actionstorage.instance().get_path(workspace=workspace)
         file_path = n("%s/%s" % (repo_path,yaml_file))
@@ -73,7 +94,7 @@ def load_yamlfile(yaml_file, workspace, user, repo):
     with open(file_path, 'r') as fd:
         yaml_str = fd.read()
     
-    return load_yamlstr(yaml_str=yaml_str)
+    return (constant.OK, yaml_str)
 
 def tab(code, nb_tab=1):
     """add tabulation for each lines"""
@@ -97,45 +118,104 @@ def create_pyjob(yaml_file, yaml_str, workspace, user, job_id):
         logger.error('jobmodel - %s' % error_str)
         return (constant.ERROR, error_str)
 
-    # loading the yaml 
-    if yaml_str is not None:
-        yaml_valid, yaml_job = load_yamlstr(yaml_str=yaml_str)
-  
+    # reading the yaml 
     if yaml_file is not None:
-        yaml_valid, yaml_job = load_yamlfile(yaml_file=yaml_file,
-                                             workspace=workspace,
-                                             user=user,
-                                             repo=constant.REPO_ACTIONS)
+        success, yaml_str = read_yamlfile(yaml_file=yaml_file,
+                                          workspace=workspace,
+                                          user=user,
+                                          repo=constant.REPO_ACTIONS)
+        if success != constant.OK:
+            return (constant.ERROR, yaml_str)
+    
+    # reading globals variables
+    globals_file = '%s/%s/%s/globals.yml' % ( settings.get_app_path(),
+                                              settings.cfg['paths']['workspaces'],
+                                              workspace )
+    success, globals_str = read_yamlfile(yaml_file=globals_file,
+                                         workspace=workspace,
+                                         user=user,
+                                         repo=constant.REPO_WORKSPACES)
+    if success != constant.OK:
+        logger.error('jobmodel - invalid globals variables')
+        return (constant.ERROR, {})
         
+    # the same sources have been already built ?
+    builds = buildstorage.instance()
+    if builds is not None:
+        prekey = builds.get_prekey(workspace=workspace,
+                                   action_str=yaml_str,
+                                   globals_str=globals_str,
+                                   output=settings.cfg['build']['output'])
+        build_key = None
+        snippets_files = builds.get_sources(prekey=prekey)
+        if snippets_files is not None:
+            sources = []
+            for snippet_file in snippets_files:
+                success, snippet_str = read_yamlfile(yaml_file=snippet_file,
+                                                     workspace=workspace,
+                                                     user=user,
+                                                     repo=constant.REPO_SNIPPETS)
+                if success != constant.OK:
+                    snippet_str = None
+                sources.append( (snippet_file, snippet_str) )
+            build_key = builds.get_key(prekey=prekey, sources=sources)
+            
+        if builds.fetch(key=build_key, job_path=job_path):
+            logger.debug('jobmodel - python job found in build cache')
+            return (constant.OK, "success")
+            
+    # loading the yaml 
+    yaml_valid, yaml_job = load_yamlstr(yaml_str=yaml_str)
     if yaml_valid != constant.OK:
         return (constant.ERROR, yaml_job)
+        
+    globals_valid, yaml_globals = load_yamlstr(yaml_str=globals_str)
+    if globals_valid != constant.OK:
+        logger.error('jobmodel - invalid globals variables')
+        return (constant.ERROR, {})
 
     # create python scripts
+    sources = []
     success, details = create_pyjob_runner(job_yaml=yaml_job,
                                            job_path=job_path,
                                            job_id=job_id,
                                            workspace=workspace,
-                                           user=user)
+                                           user=user,
+                                           yaml_globals=yaml_globals,
+                                           sources=sources)
     if success != constant.OK:
         return (constant.ERROR, details)
+        
+    # keep the generated code for the next runs
+    if builds is not None:
+        build_key = builds.get_key(prekey=prekey, sources=sources)
+        builds.store(key=build_key, prekey=prekey, 
+                     sources=sources, job_path=job_path)
 
     return (constant.OK, "success")
  
-def create_pyjob_runner(job_yaml, job_path, job_id, workspace, user):
+def create_pyjob_runner(job_yaml, job_path, job_id, workspace, user,
+                        yaml_globals, sources):
     """create python job runner"""
     logger.debug('jobmodel - creating python job runner')
+    
+    # snippets run by a pool of workers
+    max_parallel = job_yaml.get("max-parallel", 0)
+    if not isinstance(max_parallel, int) or max_parallel < 0:
+        return (constant.ERROR, "invalid max-parallel")
 
-    # loading globals variables
-    globals_file = '%s/%s/%s/globals.yml' % ( settings.get_app_path(),
-                                              settings.cfg['paths']['workspaces'],
-                                              workspace )
-    globals_valid, yaml_globals = load_yamlfile(yaml_file=globals_file,
-                                                workspace=workspace,
-                                                user=user,
-                                                repo=constant.REPO_WORKSPACES)
-    if globals_valid != constant.OK:
-        logger.error('jobmodel - invalid globals variables')
-        return (constant.ERROR, {})
+    # snippets run in child processes
+    isolations = [ job_yaml.get("isolation", jobisolation.ISOLATION_THREAD) ]
+    for snippet in job_yaml.get("snippets", []):
+        snippet_dict = tuple(snippet.values())[0]
+        isolations.append( snippet_dict.get("isolation", jobisolation.ISOLATION_THREAD) )
+    if not set(isolations).issubset(jobisolation.ISOLATIONS):
+        return (constant.ERROR, "invalid isolation")
+    isolated = jobisolation.ISOLATION_PROCESS in isolations
+    
+    max_processes = job_yaml.get("max-processes", 0)
+    if not isinstance(max_processes, int) or max_processes < 0:
+        return (constant.ERROR, "invalid max-processes")
 
     script = []
     script.append("#!/usr/bin/python")
@@ -155,49 +235,115 @@ def create_pyjob_runner(job_yaml, job_path, job_id, workspace, user):
     script.append("from ea.automateactions.joblibrary import jobhandler")
     script.append("from ea.automateactions.joblibrary import jobsnippet")
     script.append("from ea.automateactions.joblibrary import datastore")
+    if isolated:
+        script.append("from ea.automateactions.joblibrary import jobisolation")
+    if settings.cfg['build']['output'] == OUTPUT_BUNDLE:
+        script.append("from ea.automateactions.joblibrary import jobbundle")
     script.append("")
-    script.append("jobtracer.initialize(result_path=p)")
+    script.append("jobtracer.initialize(result_path=p, **jobtracer.get_settings())")
     script.append("")
     script.append("sys.stderr = jobtracer.StdWriter(mode_err=True)")
     script.append("sys.stdout = jobtracer.StdWriter()")
     script.append("")
-    script.append("jobhandler.initialize(globals=%s)" % yaml_globals)
-    script.append("datastore.initialize()")
+    
+    # the buffered log is written even if the runner fails
+    body = script
+    script = []
+    script.append("jobhandler.initialize(globals=%s, max_parallel=%s)" % (yaml_globals,
+                                                                        max_parallel))
+    script.append("datastore.initialize(shared=%s)" % isolated)
     script.append("")
+    
+    # all snippets in the job runner, precompiled in one file
+    bundle = None
+    if settings.cfg['build']['output'] == OUTPUT_BUNDLE:
+        bundle = {}
+        script.append("bundle = jobbundle.load(bundle_path=p)")
+        script.append("")
+        
     script.append( write_snippets(job_path, job_yaml,
-                                  job_id, workspace, user) )
+                                  job_id, workspace, user,
+                                  sources, bundle) )
     script.append("")
+    if isolated:
+        # forked when all snippets are registered
+        script.append("jobisolation.initialize(pool_size=%s)" % (max_processes or "os.cpu_count()"))
     script.append("jobhandler.instance().start()")
     script.append("jobhandler.finalize()")
+    if isolated:
+        script.append("jobisolation.finalize()")
     script.append("ret_code = jobhandler.get_retcode()")
     script.append("sys.exit(ret_code)")
+    
+    body.append("try:")
+    body.extend( "    %s" % line if line else line for line in "\n".join(script).split("\n") )
+    body.append("finally:")
+    body.append("    jobtracer.finalize()")
+    script = body
 
     with open(n("%s/jobrunner.py" % job_path), 'wb') as fd:
         fd.write('\n'.join(script).encode('utf-8'))
+        
+    if bundle is not None:
+        jobbundle.save(bundle_path=job_path, sources=bundle)
+        
+    # limits declared in the action, applied when the job is started
+    job_limits = job_yaml.get("limits", {})
+    if not isinstance(job_limits, dict):
+        return (constant.ERROR, "invalid limits")
+    if "timeout" in job_yaml:
+        job_limits = joblimits.merge_limits(joblimits.merge_limits({}, job_limits),
+                                            {joblimits.LIMIT_WALL_CLOCK: job_yaml["timeout"]})
+    joblimits.save_limits(job_path=job_path, limits=job_limits)
+    
+    # concurrency of the action, checked when the job is started
+    max_concurrency = job_yaml.get("max-concurrency", 0)
+    if not isinstance(max_concurrency, int) or max_concurrency < 0:
+        return (constant.ERROR, "invalid max-concurrency")
+    overlap = job_yaml.get("overlap")
+    if overlap is not None and overlap not in jobadmission.OVERLAP_POLICIES:
+        return (constant.ERROR, "invalid overlap policy")
+    jobadmission.save_policy(job_path=job_path,
+                             max_concurrency=max_concurrency,
+                             overlap=overlap)
   
     return (constant.OK, "success")
 
-def write_snippets(job_path, job_yaml, job_id, workspace, user):
-    """create python snippets"""
+def write_snippets(job_path, job_yaml, job_id, workspace, user, sources,
+                   bundle=None):
+    """create python snippets, the snippets files read
+    are added to the sources list. Snippets are added to 
+    the bundle dict instead of files when provided"""
     script = []
     if "python" in job_yaml:
-        script.append("import snippet0")
-        write_snippet(snippet_id=0,
-                      snippet_name="",
-                      snippet_src=job_yaml["python"],
-                      snippet_descr="",
-                      snippet_when={},
-                      job_path=job_path,
-                      job_id=job_id,
-                      user=user)
+        if bundle is None:
+            script.append("import snippet0")
+            write_snippet(snippet_id=0,
+                          snippet_name="",
+                          snippet_src=job_yaml["python"],
+                          snippet_descr="",
+                          snippet_when={},
+                          job_path=job_path,
+                          job_id=job_id,
+                          user=user)
+            snippet_cb = "snippet0.run_snippet"
+        else:
+            bundle[0] = ("python", job_yaml["python"])
+            snippet_cb = write_snippet_runner(snippet_id=0,
+                                              snippet_file="python",
+                                              snippet_src=job_yaml["python"],
+                                              snippet_descr="")
+        if job_yaml.get("isolation") == jobisolation.ISOLATION_PROCESS:
+            snippet_cb = "jobisolation.isolate(snippet=snippet, cb=%s)" % snippet_cb
         script.append('snippet = jobsnippet.Snippet(id=0, name="python", vars=%s)' % job_yaml.get("variables", {}) )
-        script.append("jobhandler.register(snippet=snippet, cb=snippet0.run_snippet)")
+        script.append("jobhandler.register(snippet=snippet, cb=%s)" % snippet_cb)
         script.append("")
         
     elif "snippets" in job_yaml:
         i = 1
         for snippet in job_yaml["snippets"]:
-            script.append("import snippet%s" % i)
+            if bundle is None:
+                script.append("import snippet%s" % i)
             
             snippet_name, snippet_dict= tuple(snippet.items())[0]
             snippet_descr = snippet_dict.get("description", "")
@@ -205,10 +351,17 @@ def write_snippets(job_path, job_yaml, job_id, workspace, user):
             snippet_when = snippet_dict.get("when", {})
             snippet_with = snippet_dict.get("with", {})
 
-            yaml_valid, snippet_yaml = load_yamlfile(yaml_file=snippet_file,
-                                                     workspace=workspace,
-                                                     user=user,
-                                                     repo=constant.REPO_SNIPPETS)
+            yaml_valid, snippet_str = read_yamlfile(yaml_file=snippet_file,
+                                                    workspace=workspace,
+                                                    user=user,
+                                                    repo=constant.REPO_SNIPPETS)
+            if yaml_valid == constant.OK:
+                sources.append( (snippet_file, snippet_str) )
+                yaml_valid, snippet_yaml = load_yamlstr(yaml_str=snippet_str)
+            else:
+                sources.append( (snippet_file, None) )
+                snippet_yaml = snippet_str
+                
             if yaml_valid != constant.OK:
                 src_err = []
                 src_err.append( 'snippet.error("%s")' % snippet_yaml )
@@ -242,14 +395,24 @@ def write_snippets(job_path, job_yaml, job_id, workspace, user):
                     snippet_vars[k] = v
 
             # write snippet
-            write_snippet(snippet_id=i,
-                          snippet_name=snippet_name,
-                          snippet_src=snippet_yaml["python"],
-                          snippet_descr=snippet_descr,
-                          snippet_when=snippet_when,
-                          job_path=job_path,
-                          job_id=job_id,
-                          user=user)
+            if bundle is None:
+                write_snippet(snippet_id=i,
+                              snippet_name=snippet_name,
+                              snippet_src=snippet_yaml["python"],
+                              snippet_descr=snippet_descr,
+                              snippet_when=snippet_when,
+                              job_path=job_path,
+                              job_id=job_id,
+                              user=user)
+                snippet_cb = "snippet%s.run_snippet" % i
+            else:
+                bundle[i] = (snippet_file, snippet_yaml["python"])
+                snippet_cb = write_snippet_runner(snippet_id=i,
+                                                  snippet_file=snippet_file,
+                                                  snippet_src=snippet_yaml["python"],
+                                                  snippet_descr=snippet_descr)
+            if snippet_dict.get("isolation") == jobisolation.ISOLATION_PROCESS:
+                snippet_cb = "jobisolation.isolate(snippet=snippet, cb=%s)" % snippet_cb
 
             script.append('snippet = jobsnippet.Snippet(id=%s, name="%s", when=%s, vars=%s, vars_sub=%s)' % (i,
                                                                                                              snippet_name,
@@ -257,7 +420,7 @@ def write_snippets(job_path, job_yaml, job_id, workspace, user):
                                                                                                              snippet_vars,
                                                                                                              snippet_with
                                                                                                             ))
-            script.append("jobhandler.register(snippet=snippet, cb=snippet%s.run_snippet)" % i )
+            script.append("jobhandler.register(snippet=snippet, cb=%s)" % snippet_cb )
             script.append("")
             
             i += 1
@@ -299,6 +462,16 @@ def write_snippet(snippet_id, snippet_name, snippet_src, snippet_descr, snippet_
                        snippet_src=snippet_src,
                        job_path=job_path)
     
+def write_snippet_runner(snippet_id, snippet_file, snippet_src, snippet_descr):
+    """write the runner of a snippet from the bundle"""
+    logger.debug('jobmodel - write python snippet runner')
+    
+    return "jobbundle.get_runner(snippet_id=%s, filename=%r, " \
+           "source=%r, description=%r, codes=bundle)" % (snippet_id,
+                                                         snippet_file,
+                                                         snippet_src,
+                                                         snippet_descr)
+    
 def write_snippet_import(snippet_id):
     """write snippet python import"""
     logger.debug('jobmodel - write python snippet import')
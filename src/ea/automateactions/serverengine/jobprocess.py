@@ -22,62 +22,128 @@
 # -------------------------------------------------------------------
 
 import os
+import sys
 import time
 import signal
 import uuid
 import platform
 import subprocess
 import datetime
-import json
+import threading
        
 from ea.automateactions.serversystem import logger
 from ea.automateactions.serversystem import settings
+from ea.automateactions.serversystem import supervisor
+from ea.automateactions.serversystem import cron
+from ea.automateactions.serversystem import scheduler
+from ea.automateactions.serversystem import metrics
 from ea.automateactions.serverengine import constant
 from ea.automateactions.serverengine import jobmodel
+from ea.automateactions.serverengine import jobworkers
+from ea.automateactions.serverengine import joblimits
+from ea.automateactions.serverengine import jobadmission
 from ea.automateactions.serverstorage import executionstorage
+from ea.automateactions.serverstorage import journalstorage
 from ea.automateactions.joblibrary import jobtracer
+from ea.automateactions.joblibrary import jobsandbox
 
 n = os.path.normpath
- 
+
+# user profiles shared between jobs
+USERS = {}
+
+def intern_str(value):
+    """shared copy of the string, deduplicated by hash"""
+    if value is None:
+        return None
+    return sys.intern(value)
+    
+def intern_user(user):
+    """shared copy of the user profile"""
+    key = tuple(sorted(user.items()))
+    return USERS.setdefault(key, user)
+    
 class Job():
     """class for job"""
+    __slots__ = ("job_mngr", "job_state", "job_id",
+                 "job_descr", "job_file", "job_duration", "queue_wait",
+                 "job_error", "sched_mode", "sched_at", "sched_timestamp",
+                 "sched_spread", "sched_offset", "sched_event", "user", "workspace", "process_id",
+                 "job_resources", "tracer", "job_limits", "job_breaches",
+                 "cgroup_path", "materialized")
+                 
     def __init__(self, job_mngr, job_descr, job_file, workspace,
-                       sched_mode, sched_at, user, path_backups):
+                       sched_mode, sched_at, user, job_id=None,
+                       sched_spread=0, sched_offset=None):
         """job init"""
         self.job_mngr = job_mngr
-        self.path_backups = path_backups
         
-        # job vars
+        # job vars, identical descriptions are shared
         self.job_state = constant.STATE_WAITING
-        self.job_id = str(uuid.uuid4())
-        self.job_descr = job_descr
-        self.job_file = job_file
-        # self.job_yaml = None
-        self.job_name = "Job #%s" % self.job_id
-        if self.job_file is not None:
-            self.job_name = self.job_file
+        self.job_id = job_id
+        if self.job_id is None:
+            self.job_id = str(uuid.uuid4())
+        self.job_descr = intern_str(job_descr)
+        self.job_file = intern_str(job_file)
         self.job_duration = 0
+        self.queue_wait = 0
+        self.job_error = None
         
         # schedule vars
         self.sched_mode = sched_mode
-        self.sched_at = sched_at
+        if self.sched_mode == constant.SCHED_CRON:
+            # cron expression, compiled once for all jobs
+            self.sched_at = intern_str(sched_at)
+        else:
+            self.sched_at = tuple(sched_at)
         self.sched_timestamp = 0
         self.sched_event = None
         
+        # recursive jobs are spread in the window, the offset is 
+        # kept by the next runs and after a reload
+        self.sched_spread = sched_spread
+        self.sched_offset = sched_offset
+        if self.sched_offset is None:
+            self.sched_offset = 0
+            if self.is_recursive():
+                self.sched_offset = scheduler.get_slot(self.job_id,
+                                                       sched_spread)
+        
         # user vars 
-        self.user = user
-        self.workspace = workspace
+        self.user = intern_user(user)
+        self.workspace = intern_str(workspace)
 
-        # process vars
+        # process vars, set when the job is started
         self.process_id = None
+        self.job_resources = None
+        self.tracer = None
+        
+        # limits vars
+        self.job_limits = None
+        self.job_breaches = None
+        self.cgroup_path = None
+        
+        # execution folder and code created
+        self.materialized = True
 
+    @property
+    def job_name(self):
+        """name of the job"""
+        if self.job_file is not None:
+            return self.job_file
+        return "Job #%s" % self.job_id
+        
     def set_state(self, state):
         """set state"""
         logger.debug("jobprocess - state update %s" % state)
         
+        old_state = self.job_state
         self.job_state = state
         executionstorage.update_status(job_id=self.job_id,
                                   status=self.to_dict())
+        
+        # the status is saved, the job can be evicted
+        self.job_mngr.update_job(job=self, old_state=old_state)
                                                    
     def set_event(self, event):
         """set event"""
@@ -85,28 +151,49 @@ class Job():
   
     def to_dict(self):
         """job as dict"""
-        return {"job-id": self.job_id,
-                "job-state": self.job_state,
-                "job-name": self.job_name,
-                "job-duration": self.job_duration,
-                "sched-mode": self.sched_mode,
-                "sched-at": self.sched_at,
-                "sched-timestamp": self.sched_timestamp,
-                "user": self.user,
-                "workspace": self.workspace}
+        job_dict = {"job-id": self.job_id,
+                    "job-state": self.job_state,
+                    "job-name": self.job_name,
+                    "job-duration": self.job_duration,
+                    "job-queue-wait": self.queue_wait,
+                    "sched-mode": self.sched_mode,
+                    "sched-at": self.sched_at,
+                    "sched-timestamp": self.sched_timestamp,
+                    "user": self.user,
+                    "workspace": self.workspace}
+        if self.sched_spread:
+            job_dict["sched-spread"] = self.sched_spread
+            job_dict["sched-offset"] = self.sched_offset
+        if self.job_error is not None:
+            job_dict["job-error"] = self.job_error
+        if self.job_resources is not None:
+            job_dict["job-resources"] = self.job_resources
+        if self.job_limits:
+            job_dict["job-limits"] = self.job_limits
+        if self.job_breaches:
+            job_dict["job-limits-exceeded"] = self.job_breaches
+        return job_dict
 
-    def get_next_start_time(self):
+    def get_next_start_time(self, timestamp=None):
         """Compute the next timestamp for recursive job"""
+        if timestamp is None:
+            timestamp = self.sched_timestamp
+            
+        if self.sched_mode == constant.SCHED_CRON:
+            next_fire = cron.get_next(self.sched_at,
+                                      timestamp - self.sched_offset)
+            return next_fire + self.sched_offset
+            
         _, _, _, h, mn, s = self.sched_at
         
         if self.sched_mode == constant.SCHED_DAILY:
-            new_starttime = self.sched_timestamp + 60 * 60 * 24
+            new_starttime = timestamp + 60 * 60 * 24
         if self.sched_mode == constant.SCHED_HOURLY:
-            new_starttime = self.sched_timestamp + 60 * 60
+            new_starttime = timestamp + 60 * 60
         if self.sched_mode == constant.SCHED_EVERY_X:
-            new_starttime = self.sched_timestamp + 60 * 60 * h + 60 * mn + s
+            new_starttime = timestamp + 60 * 60 * h + 60 * mn + s
         if self.sched_mode == constant.SCHED_WEEKLY:
-            new_starttime = self.sched_timestamp + 7 * 24 * 60 * 60
+            new_starttime = timestamp + 7 * 24 * 60 * 60
 
         return new_starttime
         
@@ -114,6 +201,12 @@ class Job():
         """get timestamp of the start"""
         logger.debug("jobprocess - init start time")
         
+        if self.sched_mode == constant.SCHED_CRON:
+            next_fire = cron.get_next(self.sched_at,
+                                      time.time() - self.sched_offset)
+            self.sched_timestamp = next_fire + self.sched_offset
+            return
+            
         y, m, d, h, mn, s = self.sched_at
         cur_dt = time.localtime()
         
@@ -155,13 +248,13 @@ class Job():
                 next_dt = next_dt + delta
             timestamp = time.mktime(next_dt.timetuple())
             
-        self.sched_timestamp = timestamp
+        self.sched_timestamp = timestamp + self.sched_offset
         
         # pershap the timestamp is too old
         # compute the next start time
         # only for recursive jobs
         if self.is_recursive():
-            if timestamp < time.time():
+            if self.sched_timestamp < time.time():
                 self.sched_timestamp = self.get_next_start_time()
 
     def is_recursive(self):
@@ -171,7 +264,8 @@ class Job():
         return False
         
     def kill(self):
-        """kill the job"""
+        """kill the job and all processes started by it, 
+        SIGTERM first then SIGKILL after the grace period"""
         logger.debug("jobprocess - kill the job")
         
         if self.process_id is None:
@@ -183,19 +277,41 @@ class Job():
             kill_cmd = ["taskkill"]
             kill_cmd.append("/PID")
             kill_cmd.append("%s" % self.process_id)
+            kill_cmd.append("/T")
             kill_cmd.append("/F")
             p = subprocess.Popen(kill_cmd, stdout=subprocess.PIPE)
             p.wait()
             if not p.returncode:
                 success = constant.OK
         else:
+            # the job is the leader of its own process group
             try:
-                os.kill(self.process_id, signal.SIGKILL)
+                os.killpg(self.process_id, signal.SIGTERM)
                 success = constant.OK
             except Exception as e:
                 logger.error("jobprocess - unable to kill %s" % e)
+            
+            if success == constant.OK:
+                grace = settings.cfg['jobs']['kill-grace']
+                if supervisor.instance() is not None:
+                    supervisor.call_later(delay=grace,
+                                          callback=self.force_kill)
+                else:
+                    threading.Timer(grace, self.force_kill).start()
         return success
-
+        
+    def force_kill(self):
+        """kill the processes still alive after the grace period"""
+        try:
+            os.killpg(self.process_id, signal.SIGKILL)
+        except ProcessLookupError:
+            # all processes are terminated
+            return
+        except Exception as e:
+            logger.error("jobprocess - unable to kill %s" % e)
+            return
+        logger.info("jobprocess - job %s killed after the grace period" % self.job_id)
+        
     def cancel(self):
         """cancel the result"""
         logger.debug("jobprocess - cancel the job")
@@ -203,7 +319,7 @@ class Job():
         # remove the reset storage
         executionstorage.reset_storage(job_id=self.job_id)
         
-        # delete job from disk for recursive one
+        # remove the job from the journal
         self.delete()
         
         return (constant.OK, "success")
@@ -224,10 +340,30 @@ class Job():
             
         return (constant.OK, "success")
         
+    def materialize(self):
+        """create the execution folder and build the job,
+        used for the jobs reloaded just before to run them"""
+        logger.debug("jobprocess - materialize the job")
+        
+        # folder of the job created before the restart of the server
+        executionstorage.reset_storage(job_id=self.job_id)
+        
+        success, details = self.init()
+        if success != constant.OK:
+            return (constant.ERROR, details)
+            
+        success, details = self.build()
+        if success != constant.OK:
+            return (constant.ERROR, details)
+            
+        self.materialized = True
+        return (constant.OK, "success")
+        
     def build(self):
         """build the job"""
         logger.debug("jobprocess - build python job")
 
+        start_time = time.time()
         success, details = jobmodel.create_pyjob(yaml_file=self.job_file,
                                                  yaml_str=self.job_descr,
                                                  workspace=self.workspace,
@@ -235,39 +371,27 @@ class Job():
                                                  job_id=self.job_id)
         if success != constant.OK:
             return (constant.ERROR, details)
-            
+        metrics.observe(metrics.METRIC_BUILD_TIME, time.time() - start_time)
+        
         # all is OK
         return (constant.OK, "success")
 
     def save(self):
-        """save the job on the disk"""
-        logger.debug("jobprocess - save the job on disk")
+        """save the waiting job in the journal"""
+        logger.debug("jobprocess - save the job in journal")
         
-        if self.is_recursive():
-            p = "%s/%s.json" % (self.path_backups,
-                                self.job_id)
-            p = os.path.normpath(p)
-            with open(p, "w") as fh:
-                job_dict = self.to_dict()
-                job_dict["job-file"] = self.job_file
-                job_dict["job-descr"] = self.job_descr
-                fh.write("%s" % json.dumps(job_dict))
+        job_dict = self.to_dict()
+        job_dict["job-file"] = self.job_file
+        job_dict["job-descr"] = self.job_descr
+        journalstorage.add(job=job_dict)
             
         return (constant.OK, "success")
 
     def delete(self):
-        """delete the job from disk"""
-        logger.debug("jobprocess - delete the job from disk")
+        """remove the job from the journal"""
+        logger.debug("jobprocess - delete the job from journal")
         
-        if self.is_recursive():
-            p = "%s/%s.json" % (self.path_backups,
-                                self.job_id)
-            p = os.path.normpath(p)
-            
-            try:
-                os.remove(p)
-            except Exception:
-                pass
+        journalstorage.remove(job_id=self.job_id)
         
         return (constant.OK, "success")
         
@@ -275,74 +399,223 @@ class Job():
         """run thread"""
         logger.debug("jobprocess - run the job")
         
+        # the job is no more waiting
+        self.delete()
+        
+        # the run is late, missed during a downtime or a jump of the 
+        # wall clock, measured when the scheduler fired the event,
+        # the wait in the dispatcher and the admission is not counted
+        now = time.time()
+        fire_time = now
+        if self.sched_event is not None and self.sched_event.fire_time is not None:
+            fire_time = self.sched_event.fire_time
+        catch_up = settings.cfg['scheduler']['catch-up']
+        missed = fire_time - self.sched_timestamp > settings.cfg['scheduler']['catch-up-grace']
+        
         # prepare next run if the job is recursive
         if self.is_recursive():
-            # delete from disk the current backuped job
-            self.delete()
-            
-            # register a new job with the same parameters
+            # register a new job with the same parameters,
+            # the missed runs are not replayed except with run-all
             new_start_time = self.get_next_start_time()
+            if missed and catch_up != scheduler.CATCH_UP_ALL:
+                while new_start_time <= now:
+                    new_start_time = self.get_next_start_time(timestamp=new_start_time)
             self.job_mngr.schedule_job(user=self.user,
                                        job_descr=self.job_descr,
                                        job_file=self.job_file,
                                        workspace=self.workspace,
                                        sched_mode=self.sched_mode,
                                        sched_at=self.sched_at,
-                                       sched_timestamp=new_start_time)
+                                       sched_timestamp=new_start_time,
+                                       sched_spread=self.sched_spread,
+                                       sched_offset=self.sched_offset)
+                                       
+            if missed and catch_up == scheduler.CATCH_UP_SKIP:
+                logger.info("jobprocess - missed run of job %s skipped" % self.job_id)
+                self.cancel()
+                self.job_mngr.jobs.remove(job=self)
+                return
         
-        # keep the start time of the run
-        start_time = time.time()
+        if not self.materialized:
+            success, details = self.materialize()
+            if success != constant.OK:
+                logger.error("jobprocess - unable to build "
+                             "job %s: %s" % (self.job_id, details))
+                self.job_error = "%s" % details
+                self.set_state(state=constant.STATE_FAILURE)
+                return
+                
+        # limits of concurrency of the action and of the workspace
+        decision = self.job_mngr.admit_job(job=self)
+        if decision == jobadmission.SKIPPED:
+            logger.info("jobprocess - job %s skipped, "
+                        "action already running" % self.job_id)
+            self.cancel()
+            self.job_mngr.jobs.remove(job=self)
+            return
+        if decision == jobadmission.QUEUED:
+            logger.info("jobprocess - job %s queued" % self.job_id)
+            return
+            
+        self.start()
         
+    def start(self):
+        """start the job admitted to run"""
         # change state to running
         self.set_state(state=constant.STATE_RUNNING)
         
-        # get python path according to the os
-        if platform.system() == "Windows":
-            executable = settings.cfg['paths']['python-windows']
-        else:
-            executable = settings.cfg['paths']['python-linux']
-        
         # prepare the path of the job
         p = executionstorage.get_path(job_id=self.job_id)
-        job_path = "%s/jobrunner.py" % p
-        job_path = n(job_path)
         
-        jobtracer.initialize(result_path=n(p))
+        # one tracer per job, several jobs are running at the same time
+        self.tracer = jobtracer.JobTracer(result_path=n(p),
+                                          log_format=settings.cfg['tracer']['format'])
         
-        args = [executable]
-        args.append(job_path)
-        
-        # run the job in a separate process
-        jobtracer.instance().log_job_started()
+        # run the job in a separate process, the end 
+        # is notified to finish()
+        self.tracer.log_job_started()
 
         try:
-            p = subprocess.Popen(args,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE)
-            self.process_id = p.pid
+            self.execute(job_path=n(p))
         except Exception as e:
             logger.error('jobprocess - unable to run job: %s' % e)
-            self.set_state(state=constant.STATE_FAILURE)
-        else:
-            # wait the process to complete
-            p.wait()
-            retcode = p.returncode
+            self.finish(retcode=None, duration=0, resources=None, err_str="")
             
-            # compute the duration of the job
-            self.job_duration = time.time() - start_time
+    def finish(self, retcode, duration, resources, err_str):
+        """end of the process running the job"""
+        self.job_duration = duration
+        self.job_resources = resources
+        
+        # limits exceeded by the process?
+        self.job_breaches.extend( joblimits.get_breaches(limits=self.job_limits,
+                                                         retcode=retcode,
+                                                         resources=resources,
+                                                         err_str=err_str,
+                                                         job_path=executionstorage.get_path(job_id=self.job_id),
+                                                         cgroup_path=self.cgroup_path) )
+        joblimits.remove_cgroup(cgroup_path=self.cgroup_path)
+        self.cgroup_path = None
+        
+        # set the final state of the job SUCCESS, FAILURE or TIMEOUT?
+        if retcode == 0:
+            job_result = constant.STATE_SUCCESS
+        else:
+            if len(err_str):
+                self.tracer.log_job_error(message=err_str)
+            if self.job_breaches:
+                msg = "limits exceeded: %s" % ", ".join(self.job_breaches)
+                self.tracer.log_job_error(message=msg)
             
-            # set the final state of the job SUCCESS or FAILURE?
-            if retcode == 0:
-                self.set_state(state=constant.STATE_SUCCESS)
-            else:
-                err_str = p.stderr.read().decode("utf8")
-                if len(err_str):
-                    jobtracer.instance().log_job_error(message=err_str)
-
-                self.set_state(state=constant.STATE_FAILURE)
+            job_result = constant.STATE_FAILURE
+            if joblimits.LIMIT_WALL_CLOCK in self.job_breaches:
+                job_result = constant.STATE_TIMEOUT
+        self.set_state(state=job_result)
 
-        job_result = constant.RETCODE_LIST.get(retcode, constant.STATE_FAILURE)
-        jobtracer.instance().log_job_stopped(result=job_result,
-                                             duration=self.job_duration)
-        jobtracer.finalize()
-        logger.info('jobprocess - job %s terminated' % self.job_id)
\ No newline at end of file
+        self.tracer.log_job_stopped(result=job_result,
+                                    duration=self.job_duration)
+        self.tracer.close()
+        self.tracer = None
+        logger.info('jobprocess - job %s terminated' % self.job_id)
+        
+        # start the queued jobs waiting for this one
+        self.job_mngr.release_job(job=self)
+        
+    def set_process(self, pid):
+        """set the pid of the process running the job"""
+        self.process_id = pid
+        metrics.observe(metrics.METRIC_START_LATENCY,
+                        time.time() - self.sched_timestamp)
+        
+        wall_clock = self.job_limits.get(joblimits.LIMIT_WALL_CLOCK)
+        if wall_clock and supervisor.instance() is not None:
+            supervisor.call_later(delay=wall_clock,
+                                  callback=self.check_wall_clock)
+        
+    def check_wall_clock(self):
+        """kill the job still running after the timeout"""
+        if self.job_state != constant.STATE_RUNNING:
+            return
+            
+        logger.info("jobprocess - timeout exceeded for job %s" % self.job_id)
+        self.job_breaches.append(joblimits.LIMIT_WALL_CLOCK)
+        self.kill()
+        
+    def execute(self, job_path):
+        """start the job runner in a warm worker if available,
+        otherwise in a new interpreter"""
+        # set before, the end of the job is handled even on error
+        self.job_limits = {}
+        self.job_breaches = []
+        
+        self.job_limits = joblimits.get_limits(workspace=self.workspace,
+                                               job_path=job_path)
+        
+        # rlimits and cgroups are not available on windows
+        if platform.system() == "Windows":
+            self.job_limits = { k: v for k, v in self.job_limits.items()
+                                if k == joblimits.LIMIT_WALL_CLOCK }
+        else:
+            self.cgroup_path = joblimits.create_cgroup(job_id=self.job_id,
+                                                       limits=self.job_limits)
+            
+        # same log format as the server tracer
+        env = jobtracer.get_env(log_format=settings.cfg['tracer']['format'],
+                                buffer_size=settings.cfg['tracer']['buffer-size'],
+                                flush_interval=settings.cfg['tracer']['flush-interval'])
+        
+        try:
+            if jobworkers.start_job(job_path=job_path,
+                                    env=env,
+                                    limits=self.job_limits,
+                                    cgroup_path=self.cgroup_path,
+                                    on_started=self.set_process,
+                                    on_exited=self.finish):
+                return
+        except jobworkers.ZygoteError as e:
+            logger.error("jobprocess - prefork failed, "
+                         "fallback to spawn: %s" % e)
+            
+        # get python path according to the os
+        if platform.system() == "Windows":
+            executable = settings.cfg['paths']['python-windows']
+        else:
+            executable = settings.cfg['paths']['python-linux']
+            
+        args = [executable]
+        args.append(n("%s/jobrunner.py" % job_path))
+        
+        # the limits are applied by a wrapper started before the
+        # job runner, no python code in the child of the server
+        if self.job_limits and platform.system() != "Windows":
+            args = jobsandbox.get_args(executable=executable,
+                                       job_runner=args[1],
+                                       limits=self.job_limits,
+                                       cgroup_path=self.cgroup_path)
+                                           
+        # stdout is not used by the job, stderr is drained
+        # until the end to avoid to block the process
+        start_time = time.time()
+        # a new process group to kill the snippets processes 
+        # with the job
+        p = subprocess.Popen(args,
+                             env=dict(os.environ, **env),
+                             stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE,
+                             start_new_session=platform.system() != "Windows")
+        self.set_process(pid=p.pid)
+        
+        if supervisor.instance() is not None:
+            supervisor.watch_process(proc=p, on_exit=self.finish)
+            return
+            
+        # no supervisor on windows, wait in the current thread
+        try:
+            _, err = p.communicate(timeout=self.job_limits.get(joblimits.LIMIT_WALL_CLOCK))
+        except subprocess.TimeoutExpired:
+            self.job_breaches.append(joblimits.LIMIT_WALL_CLOCK)
+            self.kill()
+            _, err = p.communicate()
+        self.finish(retcode=p.returncode,
+                    duration=time.time() - start_time,
+                    resources=None,
+                    err_str=err.decode("utf8", errors="replace"))
@@ -21,60 +21,101 @@
 # MA 02110-1301 USA
 # -------------------------------------------------------------------
 
-import threading
 import os
 import json
+import threading
 
 from ea.automateactions.serversystem import logger
 from ea.automateactions.serversystem import settings
 from ea.automateactions.serversystem import scheduler
+from ea.automateactions.serversystem import dispatcher
+from ea.automateactions.serversystem import cron
 from ea.automateactions.serverengine import constant
 from ea.automateactions.serverengine import jobprocess
+from ea.automateactions.serverengine import jobsregistry
+from ea.automateactions.serverengine import jobadmission
 from ea.automateactions.serverengine import usersmanager
 from ea.automateactions.serverengine import workspacesmanager
+from ea.automateactions.serverstorage import journalstorage
+from ea.automateactions.serverstorage import executionstorage
 
 class JobsManager():
     """jobs manager"""
-    def __init__(self, path_bckps):
+    def __init__(self, path_bckps, prepare_workers=0, prepare_queue=0):
         """init"""
-        self.jobs = []
+        self.jobs = jobsregistry.JobsRegistry()
+        self.admission = jobadmission.AdmissionQueue()
         self.path_bckps = path_bckps
+        self.mutex = threading.RLock()
+        
+        # pool used to build jobs submitted asynchronously
+        self.prepare_pool = None
+        if prepare_workers > 0:
+            self.prepare_pool = dispatcher.DispatchPool(max_workers=prepare_workers,
+                                                        max_queue=prepare_queue)
         
     def get_job(self, job_id):
         """Returns the job corresponding to the id 
         passed as argument, otherwise None"""
         logger.debug("jobsmanager - get job (id=%s)" % job_id)
         
-        for job in self.jobs:
-            if job.job_id == job_id:
-                return job
-        return None
+        return self.jobs.get(job_id=job_id)
+        
+    def update_job(self, job, old_state):
+        """state of the job updated and saved, the job is 
+        evicted from the registry when terminated"""
+        self.jobs.update(job=job, old_state=old_state)
     
+    def get_flow(self, job):
+        """flow of the job for the fair queuing in the dispatcher,
+        by workspace and optionally by user"""
+        if settings.cfg['dispatcher']['fair-users']:
+            return (job.workspace, job.user["login"])
+        return (job.workspace, None)
+        
+    def admit_job(self, job):
+        """check the limits of concurrency before to run the job,
+        the previous runs are killed with the kill-previous policy"""
+        policy = jobadmission.get_policy(workspace=job.workspace,
+                                         job_path=executionstorage.get_path(job_id=job.job_id))
+        
+        decision, to_kill = self.admission.admit(job=job, policy=policy)
+        for running_job in to_kill:
+            logger.info("jobsmanager - killing previous "
+                        "run %s" % running_job.job_id)
+            running_job.kill()
+        return decision
+        
+    def release_job(self, job):
+        """start the queued jobs admitted when the job is terminated"""
+        for queued_job in self.admission.release(job=job):
+            logger.info("jobsmanager - starting queued job %s" % queued_job.job_id)
+            
+            success = constant.ERROR
+            if dispatcher.instance() is not None:
+                success, _ = dispatcher.submit(queued_job.job_id, queued_job.start,
+                                               flow=self.get_flow(queued_job))
+            if success != constant.OK:
+                t = threading.Thread(target=queued_job.start)
+                t.start()
+                
     def get_jobs(self, user, workspace):
         """return jobs listing"""
         logger.debug("jobsmanager - get jobs for user=%s" % user["login"])
         
+        # only jobs preparing, waiting, queued or running are registered
         jobs = []
-        
-        for job in self.jobs:
-            # get the dict view of the job
-            job_dict = job.to_dict()
-            
-            # ignore job in state different from waiting or running
-            if job.job_state not in [ constant.STATE_WAITING,
-                                      constant.STATE_RUNNING ]:
-                continue
-
-            # prepare the list
-            if job.workspace == workspace:
-                jobs.append(job_dict)
+        for job in self.jobs.get_by_workspace(workspace=workspace):
+            jobs.append(job.to_dict())
         return jobs
 
     def schedule_job(self, user, job_descr=None,
                            job_file=None, workspace="common",
                            sched_mode=0, sched_at=(0, 0, 0, 0, 0, 0),
-                           sched_timestamp=0):
-        """schedule a task to run an action"""
+                           sched_timestamp=0, async_mode=False,
+                           sched_spread=0, sched_offset=None):
+        """schedule a task to run an action, with the async mode
+        the job is built in background and the id returned immediately"""
         logger.debug("jobsmanager - schedule job")
         
         # create the job
@@ -85,16 +126,45 @@ class JobsManager():
                              sched_mode=sched_mode,
                              sched_at=sched_at,
                              user=user,
-                             path_backups=self.path_bckps)
+                             sched_spread=sched_spread,
+                             sched_offset=sched_offset)
+        
+        if async_mode and self.prepare_pool is not None:
+            job.job_state = constant.STATE_PREPARING
             
         # prepare the job
         success, details = job.init()
         if success != constant.OK:
             return (constant.ERROR, details)
             
-        success, details = job.build()
+        if job.job_state != constant.STATE_PREPARING:
+            return self.prepare_job(job=job,
+                                    sched_timestamp=sched_timestamp)
+        
+        # visible in the listing until the end of the preparation
+        self.jobs.add(job=job)
+            
+        success, details = self.prepare_pool.submit(job.job_id,
+                                                    self.prepare_job,
+                                                    job=job,
+                                                    sched_timestamp=sched_timestamp)
         if success != constant.OK:
+            self.jobs.remove(job=job)
+            job.cancel()
             return (constant.ERROR, details)
+            
+        return (constant.OK, job.job_id)
+        
+    def prepare_job(self, job, sched_timestamp):
+        """build the job and register it in the scheduler"""
+        logger.debug("jobsmanager - prepare job %s" % job.job_id)
+        
+        preparing = job.job_state == constant.STATE_PREPARING
+        
+        success, details = job.build()
+        if success != constant.OK:
+            return self.fail_job(job=job, details=details,
+                                 preparing=preparing)
 
         # init start time of the job
         if sched_timestamp > 0:
@@ -102,31 +172,67 @@ class JobsManager():
         else:
             job.init_start_time()
         
-        # save the job on the disk
-        success, details = job.save()
-        if success != constant.OK:
+        with self.mutex:
+            # deleted during the preparation
+            if preparing and self.jobs.get(job_id=job.job_id) is None:
+                job.cancel()
+                return (constant.ERROR, "job deleted")
+                
+            # save the job on the disk
+            success, details = job.save()
+            if success != constant.OK:
+                return self.fail_job(job=job, details=details,
+                                     preparing=preparing)
+                
+            # ready before the registration, the job can be 
+            # started immediately by the scheduler
+            if preparing:
+                job.set_state(state=constant.STATE_WAITING)
+                
+            # Register the job on the scheduler
+            logger.info("jobsmanager - adding job %s in scheduler" % job.job_id)
+            success, details = scheduler.add_event(job.job_id,
+                                                   job.sched_timestamp,
+                                                   self.execute_job,
+                                                   job,
+                                                   flow=self.get_flow(job))
+            if success != constant.OK:
+                return self.fail_job(job=job, details="scheduler error",
+                                     preparing=preparing)
+                
+            job.set_event(event=details)
+            if not preparing:
+                self.jobs.add(job=job)
+        
+        return (constant.OK, job.job_id)
+        
+    def fail_job(self, job, details, preparing):
+        """the preparation of the job has failed"""
+        if not preparing:
             return (constant.ERROR, details)
             
-        # Register the job on the scheduler
-        logger.info("jobsmanager - adding job %s in scheduler" % job.job_id)
-        success, details = scheduler.add_event(ref=job.job_id,
-                                               timestamp=job.sched_timestamp,
-                                               callback=self.execute_job,
-                                               job=job)
-        if success != constant.OK:
-            return (constant.ERROR, "scheduler error") 
-            
-        job.set_event(event=details)
-        self.jobs.append(job)
+        logger.error("jobsmanager - unable to prepare "
+                     "job %s: %s" % (job.job_id, details))
         
-        return (constant.OK, job.job_id)
+        # the error is reported in the execution status
+        self.jobs.remove(job=job)
+        job.job_error = "%s" % details
+        job.set_state(state=constant.STATE_FAILURE)
+        
+        return (constant.ERROR, details)
+        
+    def stop(self):
+        """stop the preparation of jobs"""
+        if self.prepare_pool is not None:
+            self.prepare_pool.stop()
 
     def execute_job(self, job):
         """execute the job"""
         logger.info("jobsmanager - starting job %s" % job.job_id)
         
-        job_thread = threading.Thread(target=lambda: job.run())
-        job_thread.start()
+        # the scheduler already runs the callback in a worker thread
+        job.queue_wait = dispatcher.get_queue_wait()
+        job.run()
         
     def delete_job(self, job_id, user):
         """kill or cancel a task"""
@@ -144,79 +250,161 @@ class JobsManager():
             logger.info("jobsmanager - killing job %s" % job.job_id)
             job.kill()
             
+        with self.mutex:
+            if job.job_state == constant.STATE_PREPARING:
+                # the job will be cancelled at the end of the preparation
+                logger.info("jobsmanager - cancelling job %s" % job.job_id)
+                self.jobs.remove(job=job)
+            
+        if job.job_state == constant.STATE_QUEUED:
+            if self.admission.remove(job=job):
+                logger.info("jobsmanager - cancelling queued job %s" % job.job_id)
+                job.cancel()
+                self.jobs.remove(job=job)
+            
         if job.job_state == constant.STATE_WAITING:
             logger.info("jobsmanager - cancelling job %s" % job.job_id)
             job.cancel()
             scheduler.remove_event(job.sched_event)
-            self.jobs.remove(job)
+            self.jobs.remove(job=job)
             del job
             
         return (constant.OK, 'job deleted')
    
-    def reload_jobs(self):
-        """reload recursive jobs"""
+    def reload_jobs(self, reload_workers):
+        """reload the waiting jobs from the journal, the jobs
+        are built just before to run them"""
         logger.info("jobsmanager - reloading jobs")
-  
+        
+        jobs = journalstorage.load()
+        
+        # backup files written by the previous versions
+        legacy_jobs = []
+        legacy_files = []
         for fb in os.listdir(self.path_bckps):
-            # load the backup job file
+            if not fb.endswith(".json"):
+                continue
             with open( "%s/%s" % (self.path_bckps,fb), "r") as fh:
-                job = json.loads(fh.read())
+                legacy_jobs.append( json.loads(fh.read()) )
+            legacy_files.append(fb)
             
-            # register the recursive backuped job
-            self.schedule_job(user=job["user"],
-                              job_descr=job["job-descr"],
-                              job_file=job["job-file"],
-                              workspace=job["workspace"],
-                              sched_mode=job["sched-mode"],
-                              sched_at=job["sched-at"],
-                              sched_timestamp=job["sched-timestamp"])
-            
-            # remove old backup
+        # all jobs are registered when the pool is stopped
+        pool = dispatcher.DispatchPool(max_workers=reload_workers,
+                                       max_queue=0)
+        for job in jobs:
+            pool.submit(job["job-id"], self.reload_job,
+                        job_dict=job, journaled=True)
+        for job in legacy_jobs:
+            pool.submit(job["job-id"], self.reload_job,
+                        job_dict=job, journaled=False)
+        pool.stop()
+        
+        for fb in legacy_files:
             try:
                 os.remove("%s/%s" % (self.path_bckps,fb))
             except Exception as e:
                 pass
                 
+        return len(jobs) + len(legacy_jobs)
+        
+    def reload_job(self, job_dict, journaled):
+        """register the job in the scheduler only, with the same id"""
+        job = jobprocess.Job(job_mngr=self,
+                             job_descr=job_dict["job-descr"],
+                             job_file=job_dict["job-file"],
+                             workspace=job_dict["workspace"],
+                             sched_mode=job_dict["sched-mode"],
+                             sched_at=job_dict["sched-at"],
+                             user=job_dict["user"],
+                             job_id=job_dict["job-id"],
+                             sched_spread=job_dict.get("sched-spread", 0),
+                             sched_offset=job_dict.get("sched-offset"))
+        job.sched_timestamp = job_dict["sched-timestamp"]
+        job.materialized = False
+        
+        if not journaled:
+            job.save()
+            
+        success, details = scheduler.add_event(job.job_id,
+                                               job.sched_timestamp,
+                                               self.execute_job,
+                                               job,
+                                               flow=self.get_flow(job))
+        if success != constant.OK:
+            logger.error("jobsmanager - unable to reload job %s" % job.job_id)
+            job.delete()
+            return
+            
+        job.set_event(event=details)
+        self.jobs.add(job=job)
+        
 JobsMngr = None
 def instance():
     """Returns the singleton"""
     return JobsMngr
 
-def initialize(path_bckps):
+def initialize(path_bckps, prepare_workers=0, prepare_queue=0):
     """Instance creation"""
     global JobsMngr
-    JobsMngr = JobsManager(path_bckps=path_bckps)
+    JobsMngr = JobsManager(path_bckps=path_bckps,
+                           prepare_workers=prepare_workers,
+                           prepare_queue=prepare_queue)
     
 def finalize():
     """Destruction of the singleton"""
     global JobsMngr
     if JobsMngr:
-        del JobsMngr
+        JobsMngr.stop()
+        JobsMngr = None
         
+def get_stats():
+    """stats of the jobs registry"""
+    return instance().jobs.get_stats()
+    
 def get_jobs(user, workspace):
     """return jobs listing"""
     return instance().get_jobs(user=user, workspace=workspace)
     
-def reload_jobs():
+def reload_jobs(reload_workers):
     """reload jobs"""
-    return instance().reload_jobs()
+    return instance().reload_jobs(reload_workers=reload_workers)
     
 def delete_job(id, user):
     """delete job"""
     return instance().delete_job(job_id=id, user=user)
 
+def get_spread(workspace, spread=None):
+    """spread window of the job, from the request, 
+    the workspace or the default value"""
+    if spread is not None:
+        return spread
+    cfg = settings.cfg['scheduler']
+    return cfg['spread-workspaces'].get(workspace, cfg['spread'])
+    
 def schedule_job(user, job_descr, job_file, workspace,
-                 sched_mode, sched_at):
+                 sched_mode, sched_at, async_mode=False, spread=None):
     """schedule a job"""
     logger.info("scheduling new job "
                 "user=%s mode=%s at=%s" % (user["login"],
                                            sched_mode,
                                            sched_at) )
 
+    # cheap checks before to accept the job
+    if workspacesmanager.search_workspace(name=workspace) is None:
+        return (constant.NOT_FOUND, "workspace=%s not found" % workspace)
+        
+    if sched_mode == constant.SCHED_CRON:
+        try:
+            cron.compile_expression(sched_at)
+        except cron.CronError as e:
+            return (constant.FAILED, "invalid cron expression: %s" % e)
+            
     # all is ok, the schedule of the job can be done
     return instance().schedule_job(user=user,
                                    job_descr=job_descr,
                                    job_file=job_file,
                                    workspace=workspace,
                                    sched_mode=sched_mode,
-                                   sched_at=sched_at)
+                                   sched_at=sched_at,
+                                   async_mode=async_mode,
+                                   sched_spread=get_spread(workspace, spread))
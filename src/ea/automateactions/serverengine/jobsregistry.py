@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+import threading
+
+from ea.automateactions.serverengine import constant
+
+# jobs kept in the registry, the others are evicted
+ACTIVE_STATES = [ constant.STATE_PREPARING,
+                  constant.STATE_WAITING,
+                  constant.STATE_QUEUED,
+                  constant.STATE_RUNNING ]
+
+class JobsRegistry():
+    """jobs indexed by id, workspace and state, terminated jobs 
+    are evicted, their status is available in the executions storage"""
+    def __init__(self):
+        """class init"""
+        self.mutex = threading.RLock()
+        self.jobs = {}
+        self.workspaces = {}
+        self.states = { state: {} for state in ACTIVE_STATES }
+        self.nb_evicted = 0
+        
+    def __len__(self):
+        """number of jobs"""
+        return len(self.jobs)
+        
+    def add(self, job):
+        """add the job, ignored if already terminated"""
+        with self.mutex:
+            if job.job_state not in ACTIVE_STATES:
+                return False
+            self.jobs[job.job_id] = job
+            self.workspaces.setdefault(job.workspace, {})[job.job_id] = job
+            self.states[job.job_state][job.job_id] = job
+        return True
+        
+    def remove(self, job):
+        """remove the job, returns False if not registered"""
+        with self.mutex:
+            if self.jobs.get(job.job_id) is not job:
+                return False
+            del self.jobs[job.job_id]
+            
+            jobs_ws = self.workspaces[job.workspace]
+            del jobs_ws[job.job_id]
+            if not jobs_ws:
+                del self.workspaces[job.workspace]
+                
+            for jobs_state in self.states.values():
+                jobs_state.pop(job.job_id, None)
+        return True
+        
+    def get(self, job_id):
+        """get the job by id, None if not found"""
+        return self.jobs.get(job_id)
+        
+    def update(self, job, old_state):
+        """move the job to the index of its new state,
+        evicted when terminated"""
+        with self.mutex:
+            if self.jobs.get(job.job_id) is not job:
+                return
+                
+            if job.job_state not in ACTIVE_STATES:
+                self.remove(job)
+                self.nb_evicted += 1
+                return
+                
+            self.states[old_state].pop(job.job_id, None)
+            self.states[job.job_state][job.job_id] = job
+            
+    def get_by_workspace(self, workspace):
+        """jobs of the workspace"""
+        with self.mutex:
+            return list(self.workspaces.get(workspace, {}).values())
+            
+    def get_by_state(self, state):
+        """jobs in the state"""
+        with self.mutex:
+            return list(self.states.get(state, {}).values())
+            
+    def get_stats(self):
+        """return stats of the registry"""
+        with self.mutex:
+            stats = { state.lower(): len(jobs) 
+                      for state, jobs in self.states.items() }
+            stats["total"] = len(self.jobs)
+            stats["workspaces"] = len(self.workspaces)
+            stats["evicted"] = self.nb_evicted
+            return stats
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+import os
+import time
+import json
+import threading
+import subprocess
+
+from ea.automateactions.serversystem import logger
+from ea.automateactions.serversystem import settings
+from ea.automateactions.serversystem import supervisor
+
+n = os.path.normpath
+
+MODE_SPAWN = "spawn"
+MODE_PREFORK = "prefork"
+
+class ZygoteError(Exception):
+    pass
+    
+class Zygote():
+    """warm python interpreter forking a child for each job"""
+    def __init__(self, executable, recycle_after, on_release):
+        """class init"""
+        self.executable = executable
+        self.recycle_after = recycle_after
+        self.on_release = on_release
+        self.proc = None
+        self.nb_jobs = 0
+        
+        # current job
+        self.buffer = b""
+        self.err_path = None
+        self.start_time = 0
+        self.on_started = None
+        self.on_exited = None
+        
+    def spawn(self):
+        """start the interpreter"""
+        zygote_path = "%s/joblibrary/jobzygote.py" % settings.get_app_path()
+        self.proc = subprocess.Popen([self.executable, n(zygote_path)],
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL)
+        self.nb_jobs = 0
+        self.buffer = b""
+        logger.debug("jobworkers - zygote started pid=%s" % self.proc.pid)
+        
+    def is_alive(self):
+        """return True if the interpreter is running"""
+        return self.proc is not None and self.proc.poll() is None
+        
+    def stop(self):
+        """stop the interpreter after the current job"""
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+            self.proc.wait()
+            self.proc.stdout.close()
+        except Exception as e:
+            logger.error("jobworkers - unable to stop zygote: %s" % e)
+        self.proc = None
+        
+    def start_job(self, job_path, env, limits, cgroup_path, 
+                        on_started, on_exited):
+        """run the job in a forked child, the events sent by the 
+        interpreter are read from the supervisor loop"""
+        self.err_path = n("%s/stderr.log" % job_path)
+        self.start_time = time.time()
+        self.on_started = on_started
+        self.on_exited = on_exited
+        
+        req = {"job-path": job_path, "err-path": self.err_path, "env": env,
+               "limits": limits, "cgroup-path": cgroup_path}
+        try:
+            self.proc.stdin.write(b"%s\n" % json.dumps(req).encode("utf8"))
+            self.proc.stdin.flush()
+        except Exception as e:
+            # the job is not started, the caller can run it in 
+            # a new interpreter
+            self.proc = None
+            raise ZygoteError("unable to start job: %s" % e)
+            
+        supervisor.watch_stream(fd=self.proc.stdout.fileno(),
+                                on_data=self.read_events)
+        
+    def read_events(self, data):
+        """events sent by the interpreter, one json per line"""
+        if not data:
+            logger.error("jobworkers - zygote terminated unexpectedly")
+            self.proc.kill()
+            self.proc.wait()
+            self.proc.stdout.close()
+            self.proc = None
+            self.end_job(retcode=None, resources=None,
+                         err_str="zygote terminated unexpectedly")
+            return
+            
+        self.buffer += data
+        while b"\n" in self.buffer:
+            line, self.buffer = self.buffer.split(b"\n", 1)
+            event = json.loads(line.decode("utf8"))
+            
+            if event["event"] == "started":
+                self.on_started(event["pid"])
+                
+            if event["event"] == "exited":
+                supervisor.unwatch_stream(fd=self.proc.stdout.fileno())
+                self.nb_jobs += 1
+                
+                err_str = ""
+                try:
+                    with open(self.err_path, "r") as fh:
+                        err_str = fh.read()
+                    os.remove(self.err_path)
+                except Exception:
+                    pass
+                self.end_job(retcode=event["retcode"],
+                             resources=event["resources"],
+                             err_str=err_str)
+                
+    def end_job(self, retcode, resources, err_str):
+        """notify the end of the job"""
+        duration = time.time() - self.start_time
+        on_exited = self.on_exited
+        self.on_started = None
+        self.on_exited = None
+        
+        # recycled and available again out of the loop of the supervisor,
+        # stopping and spawning the interpreter are blocking
+        supervisor.call_exit(self.on_release, self)
+        supervisor.call_exit(on_exited, retcode, duration, resources, err_str)
+        
+class ZygotePool():
+    """pool of warm python interpreters"""
+    def __init__(self, executable, pool_size, recycle_after):
+        """class init"""
+        self.mutex = threading.Lock()
+        self.zygotes = []
+        self.idle = []
+        for _ in range(pool_size):
+            z = Zygote(executable=executable,
+                       recycle_after=recycle_after,
+                       on_release=self.release)
+            z.spawn()
+            self.zygotes.append(z)
+            self.idle.append(z)
+    
+    def acquire(self):
+        """take an idle interpreter, None if all are busy"""
+        with self.mutex:
+            if not self.idle:
+                return None
+            z = self.idle.pop()
+            
+        if not z.is_alive():
+            try:
+                z.spawn()
+            except Exception as e:
+                logger.error("jobworkers - unable to start zygote: %s" % e)
+                with self.mutex:
+                    self.idle.append(z)
+                return None
+        return z
+        
+    def start_job(self, job_path, env, limits, cgroup_path,
+                        on_started, on_exited):
+        """run the job in an idle interpreter, returns False 
+        if all are busy"""
+        z = self.acquire()
+        if z is None:
+            return False
+            
+        try:
+            z.start_job(job_path=job_path,
+                        env=env,
+                        limits=limits,
+                        cgroup_path=cgroup_path,
+                        on_started=on_started,
+                        on_exited=on_exited)
+        except ZygoteError:
+            self.release(z)
+            raise
+        return True
+        
+    def release(self, z):
+        """give back the interpreter, recycle it if needed"""
+        if z.proc is not None and z.nb_jobs >= z.recycle_after:
+            logger.debug("jobworkers - recycling zygote after "
+                         "%s jobs" % z.nb_jobs)
+            z.stop()
+        
+        # start a new one right now, the next job will find it warm
+        if not z.is_alive():
+            try:
+                z.spawn()
+            except Exception as e:
+                logger.error("jobworkers - unable to start zygote: %s" % e)
+                
+        with self.mutex:
+            self.idle.append(z)
+    
+    def stop(self):
+        """stop all interpreters"""
+        for z in self.zygotes:
+            z.stop()
+       
+Pool = None
+
+def instance():
+    """Returns the singleton"""
+    return Pool
+
+def initialize(executable, pool_size, recycle_after):
+    """Instance creation"""
+    global Pool
+    Pool = ZygotePool(executable=executable,
+                      pool_size=pool_size,
+                      recycle_after=recycle_after)
+
+def finalize():
+    """Destruction of the singleton"""
+    global Pool
+    if Pool:
+        Pool.stop()
+        Pool = None
+        
+def start_job(job_path, env, limits, cgroup_path, on_started, on_exited):
+    """run the job in a warm worker, returns False if the 
+    pool is disabled or all workers are busy"""
+    if instance() is None:
+        return False
+    return instance().start_job(job_path=job_path,
+                                env=env,
+                                limits=limits,
+                                cgroup_path=cgroup_path,
+                                on_started=on_started,
+                                on_exited=on_exited)
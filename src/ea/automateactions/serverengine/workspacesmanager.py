@@ -96,6 +96,10 @@ class WorkspacesManager:
             return name
         return None
             
+    def get_weights(self):
+        """weights of the workspaces for the fair queuing"""
+        return self.cache.get("weights") or {}
+        
     def get_workspaces(self):
         """get all workspaces"""
         logger.debug("workspacesmanager - get list")
@@ -168,6 +172,10 @@ def del_workspace(name):
 def get_workspaces():
     """get all workspaces"""
     return instance().get_workspaces()
+    
+def get_weights():
+    """get the weights of the workspaces"""
+    return instance().get_weights()
         
 def instance():
     """Returns the singleton"""
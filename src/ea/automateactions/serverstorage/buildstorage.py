@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+import collections
+
+from ea.automateactions.serverengine import constant
+from ea.automateactions.serversystem import logger
+
+n = os.path.normpath
+
+# generated python files and precompiled bundles
+BUILD_EXTENSIONS = (".py", ".bin")
+
+# other files generated with the job
+BUILD_FILES = ("limits.json", "admission.json")
+
+class BuildsStorage():
+    """cache of the python code generated for jobs, 
+    indexed by the hash of the yaml sources"""
+    def __init__(self, repo_path, max_entries):
+        """class init"""
+        self.repo_path = repo_path
+        self.max_entries = max_entries
+        self.mutex = threading.RLock()
+        
+        # key -> details of the build, in LRU order
+        self.cache = collections.OrderedDict()
+        # hash of the action -> snippets files used by the action
+        self.manifests = {}
+        
+        self.nb_hits = 0
+        self.nb_misses = 0
+        self.nb_evictions = 0
+        
+        self.init_cache()
+        
+    def init_cache(self):
+        """reload builds from a previous run, the oldest first"""
+        entries = []
+        for entry in list(os.scandir("%s/" % self.repo_path)):
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            try:
+                with open("%s/build.json" % entry.path, "r") as fh:
+                    build = json.loads(fh.read())
+                entries.append( (entry.stat().st_mtime, entry.name, build) )
+            except Exception as e:
+                logger.error("buildstorage - bad entry: %s" % e)
+                shutil.rmtree(entry.path, ignore_errors=True)
+                
+        for _, key, build in sorted(entries):
+            self.cache[key] = build
+            self.manifests[build["prekey"]] = build["sources"]
+        self.evict()
+        
+        logger.debug("buildstorage - cache nb items: %s" % len(self.cache))
+        
+    def get_path(self, key):
+        """get build path"""
+        return n("%s/%s" % (self.repo_path, key))
+        
+    def get_prekey(self, workspace, action_str, globals_str, output):
+        """hash of the action and globals variables"""
+        h = hashlib.sha256()
+        for v in [workspace, output, action_str, globals_str]:
+            h.update(("%s\0" % v).encode("utf8"))
+        return h.hexdigest()
+        
+    def get_key(self, prekey, sources):
+        """hash of the action and the content of all snippets,
+        sources is a list of (snippet file, content)"""
+        h = hashlib.sha256()
+        h.update(prekey.encode("utf8"))
+        for name, content in sources:
+            h.update(("\0%s\0%s" % (name, content)).encode("utf8"))
+        return h.hexdigest()
+        
+    def get_sources(self, prekey):
+        """return the snippets files used by the action, 
+        None if the action has never been built"""
+        with self.mutex:
+            return self.manifests.get(prekey)
+            
+    def fetch(self, key, job_path):
+        """link the files of the build in the job folder,
+        returns False if the build is not in the cache
+        or if the key is None"""
+        with self.mutex:
+            if key is None or key not in self.cache:
+                self.nb_misses += 1
+                return False
+            self.cache.move_to_end(key)
+            self.nb_hits += 1
+            files = self.cache[key]["files"]
+            
+            # still under lock, the build can not be evicted
+            # while the files are linked
+            build_path = self.get_path(key=key)
+            try:
+                for f in files:
+                    link_file(src=n("%s/%s" % (build_path, f)),
+                              dst=n("%s/%s" % (job_path, f)))
+            except Exception as e:
+                logger.error("buildstorage - unable to fetch build: %s" % e)
+                return False
+        return True
+        
+    def store(self, key, prekey, sources, job_path):
+        """save the python files generated in the job folder"""
+        build_path = self.get_path(key=key)
+        
+        with self.mutex:
+            if key in self.cache:
+                return (constant.OK, "build already cached")
+                
+            files = [ f for f in os.listdir(job_path) 
+                        if f.endswith(BUILD_EXTENSIONS) or f in BUILD_FILES ]
+            build = {"prekey": prekey,
+                     "sources": [ name for name, _ in sources ],
+                     "files": files}
+            try:
+                os.mkdir(build_path, 0o755)
+                for f in files:
+                    shutil.copyfile(n("%s/%s" % (job_path, f)),
+                                    n("%s/%s" % (build_path, f)))
+                with open("%s/build.json" % build_path, "w") as fh:
+                    fh.write(json.dumps(build))
+            except Exception as e:
+                logger.error("buildstorage - unable to store build: %s" % e)
+                shutil.rmtree(build_path, ignore_errors=True)
+                return (constant.ERROR, "unable to store build")
+                
+            self.cache[key] = build
+            self.manifests[prekey] = build["sources"]
+            self.evict()
+            
+        return (constant.OK, "build cached")
+        
+    def evict(self):
+        """remove the least recently used builds"""
+        with self.mutex:
+            while len(self.cache) > self.max_entries:
+                key, build = self.cache.popitem(last=False)
+                self.manifests.pop(build["prekey"], None)
+                shutil.rmtree(self.get_path(key=key), ignore_errors=True)
+                self.nb_evictions += 1
+                
+    def get_stats(self):
+        """return stats of the cache"""
+        with self.mutex:
+            return {"max-entries": self.max_entries,
+                    "entries": len(self.cache),
+                    "hits": self.nb_hits,
+                    "misses": self.nb_misses,
+                    "evictions": self.nb_evictions}
+
+def link_file(src, dst):
+    """hard link the file, copy it if links are not supported"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+        
+RepoBuilds = None
+
+def get_stats():
+    """get stats of the cache"""
+    return instance().get_stats()
+    
+def instance():
+    """Returns the singleton"""
+    return RepoBuilds
+
+def initialize(repo_path, max_entries):
+    """Instance creation"""
+    global RepoBuilds
+    RepoBuilds = BuildsStorage(repo_path=repo_path,
+                               max_entries=max_entries)
+
+def finalize():
+    """Destruction of the singleton"""
+    global RepoBuilds
+    if RepoBuilds:
+        RepoBuilds = None
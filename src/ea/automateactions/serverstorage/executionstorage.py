@@ -24,18 +24,38 @@
 import os
 import json
 import shutil
+import threading
+import collections
 
 from ea.automateactions.serverengine import constant
 from ea.automateactions.serverengine import usersmanager
+from ea.automateactions.serverengine import jobsregistry
 from ea.automateactions.serversystem import logger
 from ea.automateactions.serversystem import settings
+from ea.automateactions.joblibrary import jobtracer
+
+# sidecar index of the json log, byte offsets
+# of the lines per snippet and every INDEX_STEP lines
+INDEX_FILE = "job.idx"
+INDEX_STEP = 1000
+
+# statuses of the terminated jobs, one json line per job,
+# read from the disk for the listing of the evicted ones
+LISTING_FILE = "listing.jsonl"
 
 class ExecutionsStorage():
     """executions storage"""
-    def __init__(self, repo_path):
-        """repository class"""
+    def __init__(self, repo_path, cache_size=0):
+        """repository class, the statuses of the terminated jobs 
+        kept in memory are limited to the cache size, zero is unlimited"""
         self.repo_path = repo_path
         self.cache = {}
+        self.cache_size = cache_size
+        self.terminated = collections.OrderedDict()
+        self.cache_mutex = threading.Lock()
+        self.mutex = threading.Lock()
+        self.listing_fd = None
+        self.init_listing()
         self.init_cache()
         
     def init_cache(self):
@@ -49,10 +69,67 @@ class ExecutionsStorage():
                     with open("%s/settings.json" % entry.path, "r") as fh:
                         entry_details = fh.read()
                     
-                    self.cache[entry.name] = json.loads(entry_details)
+                    self.set_cache(job_id=entry.name,
+                                   status=json.loads(entry_details))
                 except Exception as e:
                     logger.error("reporesults - bad entry: %s" % e)
 
+    def init_listing(self):
+        """remove the deleted executions from the listing file
+        and open it to append the next terminated jobs"""
+        listing = self.read_listing()
+        with open("%s/%s.tmp" % (self.repo_path, LISTING_FILE), "w") as fh:
+            for status in listing.values():
+                fh.write("%s\n" % json.dumps(status))
+        os.replace("%s/%s.tmp" % (self.repo_path, LISTING_FILE),
+                   "%s/%s" % (self.repo_path, LISTING_FILE))
+        self.listing_fd = open("%s/%s" % (self.repo_path, LISTING_FILE), "a", 1)
+                   
+    def read_listing(self):
+        """statuses of the listing file by job id, 
+        the executions deleted are ignored"""
+        listing = {}
+        try:
+            with open("%s/%s" % (self.repo_path, LISTING_FILE), "r") as fh:
+                for line in fh:
+                    # the last line is truncated on crash
+                    if not line.endswith("\n"):
+                        break
+                    status = json.loads(line)
+                    listing[status["job-id"]] = status
+        except FileNotFoundError:
+            pass
+        return { job_id: status for job_id, status in listing.items()
+                 if os.path.isdir(self.get_path(job_id=job_id)) }
+        
+    def set_cache(self, job_id, status):
+        """cache the status, the terminated jobs are added to the
+        listing file, the oldest ones are evicted and read from the disk"""
+        with self.cache_mutex:
+            self.cache[job_id] = status
+            if status.get("job-state") in jobsregistry.ACTIVE_STATES:
+                return
+            if self.listing_fd is not None:
+                self.listing_fd.write("%s\n" % json.dumps(status))
+            self.terminated[job_id] = None
+            self.terminated.move_to_end(job_id)
+            if self.cache_size:
+                while len(self.terminated) > self.cache_size:
+                    evicted_id, _ = self.terminated.popitem(last=False)
+                    self.cache.pop(evicted_id, None)
+                
+    def del_cache(self, job_id):
+        """remove the status from the cache"""
+        with self.cache_mutex:
+            self.cache.pop(job_id, None)
+            self.terminated.pop(job_id, None)
+        
+    def has_result(self, job_id):
+        """True if the result exists, in the cache or on the disk"""
+        if job_id in self.cache:
+            return True
+        return os.path.exists( "%s/status.json" % self.get_path(job_id=job_id) )
+        
     def get_path(self, job_id):
         """get result path"""
         results_path = "%s/%s/" % (self.repo_path, job_id)
@@ -60,7 +137,7 @@ class ExecutionsStorage():
         
     def del_result(self, job_id, user):
         """delete result"""
-        if job_id not in self.cache:
+        if not self.has_result(job_id=job_id):
             return (constant.NOT_FOUND, 'result id=%s does not exist' % job_id)
 
         try:
@@ -69,16 +146,21 @@ class ExecutionsStorage():
         except Exception as e:
             logger.error("reporesults - rm result failed: %s" % e)
   
-        del self.cache[job_id]
+        self.del_cache(job_id=job_id)
         
         return (constant.OK, 'result folder removed')
     
     def get_status(self, job_id, user):
         """get status"""
-        if job_id not in self.cache:
+        if job_id in self.cache:
+            return (constant.OK, self.cache[job_id])
+            
+        # evicted from the cache
+        if not self.has_result(job_id=job_id):
             return (constant.NOT_FOUND, 'result id=%s does not exist' % job_id)
-
-        return (constant.OK, self.cache[job_id])
+        with open("%s/status.json" % self.get_path(job_id=job_id), "r") as fh:
+            status = json.loads(fh.read())
+        return (constant.OK, status)
         
     def update_status(self, job_id, status):
         """update status"""
@@ -87,7 +169,7 @@ class ExecutionsStorage():
         with open("%s/status.json" % p, "w") as fh:
             fh.write("%s" % json.dumps(status))
 
-        self.cache[job_id] = status
+        self.set_cache(job_id=job_id, status=status)
         
         return (constant.OK, 'result status updated')
         
@@ -98,7 +180,7 @@ class ExecutionsStorage():
         with open("%s/status.json" % p, "w") as fh:
             fh.write("%s" % json.dumps(status))
 
-        self.cache[job_id] = status
+        self.set_cache(job_id=job_id, status=status)
         
         return (constant.OK, 'result status added')
 
@@ -109,6 +191,7 @@ class ExecutionsStorage():
             shutil.rmtree(p)
         except Exception:
             pass
+        self.del_cache(job_id=job_id)
             
     def init_storage(self, job_id):
         """init result storage"""
@@ -125,30 +208,132 @@ class ExecutionsStorage():
         
         return (constant.OK, 'result storage initiated')
         
+    def get_log_format(self, job_id):
+        """return the format of the log of the execution"""
+        p = self.get_path(job_id=job_id)
+        for log_format, log_file in jobtracer.LOG_FILES.items():
+            if os.path.exists( "%s/%s" % (p, log_file) ):
+                return log_format
+        return None
+        
     def get_logs(self, job_id, user, log_index):
-        """get logs"""
-        if job_id not in self.cache:
+        """get logs, the json log is rendered in text"""
+        if not self.has_result(job_id=job_id):
             return (constant.NOT_FOUND, 'result id=%s does not exist' % job_id)
 
         logs = ''
         index = 0
         p = self.get_path(job_id=job_id)
+        log_format = self.get_log_format(job_id=job_id)
         
-        if os.path.exists( "%s/job.log" % p):
+        if log_format == jobtracer.FORMAT_TEXT:
             with open("%s/job.log" % p, "r") as fh:
                 fh.seek(log_index)
                 logs = fh.read()
                 index = fh.tell()
+                
+        if log_format == jobtracer.FORMAT_JSONL:
+            lines = []
+            index = log_index
+            with open("%s/job.jsonl" % p, "rb") as fh:
+                fh.seek(log_index)
+                for line in fh:
+                    # the last line is still written by the job
+                    if not line.endswith(b"\n"):
+                        break
+                    lines.append( jobtracer.get_text(record=json.loads(line)) )
+                    index += len(line)
+            logs = "".join(lines)
             
         return (constant.OK, {"logs": logs,"index": index})
         
+    def update_index(self, job_id):
+        """index the lines added to the json log since the last call"""
+        p = self.get_path(job_id=job_id)
+        
+        index = {"offset": 0, "nb-lines": 0, "last-ref": None,
+                 "lines": [], "snippets": {}}
+        if os.path.exists( "%s/%s" % (p, INDEX_FILE) ):
+            with open("%s/%s" % (p, INDEX_FILE), "r") as fh:
+                index = json.loads(fh.read())
+                
+        offset = index["offset"]
+        with open("%s/job.jsonl" % p, "rb") as fh:
+            fh.seek(offset)
+            for line in fh:
+                if not line.endswith(b"\n"):
+                    break
+                if index["nb-lines"] % INDEX_STEP == 0:
+                    index["lines"].append(offset)
+                    
+                # consecutive lines of a snippet are kept in one range
+                ref = "%s" % json.loads(line)["ref"]
+                ranges = index["snippets"].setdefault(ref, [])
+                if ref == index["last-ref"]:
+                    ranges[-1][1] += 1
+                else:
+                    ranges.append( [offset, 1] )
+                index["last-ref"] = ref
+                
+                index["nb-lines"] += 1
+                offset += len(line)
+                
+        if offset != index["offset"]:
+            index["offset"] = offset
+            with open("%s/%s.tmp" % (p, INDEX_FILE), "w") as fh:
+                fh.write("%s" % json.dumps(index))
+            os.replace("%s/%s.tmp" % (p, INDEX_FILE), "%s/%s" % (p, INDEX_FILE))
+            
+        return index
+        
+    def get_events(self, job_id, user, snippet_id=None, line_start=0, line_end=None):
+        """get the events of the json log for one snippet or a range 
+        of lines, read from the offsets of the index"""
+        if not self.has_result(job_id=job_id):
+            return (constant.NOT_FOUND, 'result id=%s does not exist' % job_id)
+            
+        if self.get_log_format(job_id=job_id) != jobtracer.FORMAT_JSONL:
+            return (constant.FAILED, 'no json log for result id=%s' % job_id)
+            
+        with self.mutex:
+            index = self.update_index(job_id=job_id)
+        
+        # ranges of lines to read, (offset, number of lines, lines to skip)
+        if snippet_id is not None:
+            ranges = [ (o, nb, 0) for o, nb in index["snippets"].get("%s" % snippet_id, []) ]
+        else:
+            if line_end is None or line_end > index["nb-lines"]:
+                line_end = index["nb-lines"]
+            ranges = []
+            if line_start < line_end:
+                ranges.append( (index["lines"][line_start // INDEX_STEP],
+                                line_end - line_start,
+                                line_start % INDEX_STEP) )
+
+        events = []
+        p = self.get_path(job_id=job_id)
+        with open("%s/job.jsonl" % p, "rb") as fh:
+            for offset, nb_lines, nb_skip in ranges:
+                fh.seek(offset)
+                for _ in range(nb_skip):
+                    fh.readline()
+                for _ in range(nb_lines):
+                    events.append( json.loads(fh.readline()) )
+                    
+        return (constant.OK, {"events": events, "nb-lines": index["nb-lines"]})
+        
     def get_results(self, workspace, user):
-        """get result according to the workspaces provided and user"""
+        """get result according to the workspaces provided and user,
+        the jobs evicted from the cache are read from the listing file"""
         listing = []
 
-        for _, res in self.cache.items():
+        statuses = self.read_listing()
+        statuses.update(self.cache)
+        for res in list(statuses.values()):
             # ignore waiting job
-            if res["job-state"] == "WAITING":
+            if res["job-state"] in [ constant.STATE_PREPARING,
+                                     constant.STATE_WAITING,
+                                     constant.STATE_QUEUED ]:
                 continue
 
             # append the result to the list 
@@ -172,6 +357,14 @@ def get_logs(job_id, user, index):
                                user=user,
                                log_index=int(index))
     
+def get_events(job_id, user, snippet_id=None, line_start=0, line_end=None):
+    """get events of the json log"""
+    return instance().get_events(job_id=job_id,
+                                 user=user,
+                                 snippet_id=snippet_id,
+                                 line_start=line_start,
+                                 line_end=line_end)
+    
 def del_result(job_id, user):
     """delete result"""
     return instance().del_result(job_id=job_id,
@@ -214,13 +407,15 @@ def instance():
     """Returns the singleton"""
     return RepoExecs
 
-def initialize(repo_path):
+def initialize(repo_path, cache_size=0):
     """Instance creation"""
     global RepoExecs
-    RepoExecs = ExecutionsStorage(repo_path=repo_path)
+    RepoExecs = ExecutionsStorage(repo_path=repo_path,
+                                  cache_size=cache_size)
 
 def finalize():
     """Destruction of the singleton"""
     global RepoExecs
     if RepoExecs:
+        RepoExecs.listing_fd.close()
         RepoExecs = None
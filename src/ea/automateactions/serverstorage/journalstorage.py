@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+import os
+import json
+import threading
+
+from ea.automateactions.serverengine import constant
+from ea.automateactions.serversystem import logger
+
+n = os.path.normpath
+
+JOURNAL_FILE = "jobs.journal"
+
+OP_ADD = "add"
+OP_DEL = "del"
+
+class JournalStorage():
+    """append-only journal of the waiting jobs, records are written
+    and synced to the disk by batch then compacted periodically"""
+    def __init__(self, repo_path, flush_interval, compact_min):
+        """class init"""
+        self.journal_path = n("%s/%s" % (repo_path, JOURNAL_FILE))
+        self.flush_interval = flush_interval
+        self.compact_min = compact_min
+        
+        # records waiting to be written
+        self.mutex = threading.Lock()
+        self.buffer = []
+        
+        # the file is rewritten during the compaction
+        self.file_mutex = threading.Lock()
+        self.fh = open(self.journal_path, "a")
+        if not self.is_terminated():
+            # record truncated by a crash, not merged with the next one
+            self.fh.write("\n")
+            self.fh.flush()
+        
+        # number of records in the file and jobs still waiting
+        self.nb_records = 0
+        self.nb_jobs = 0
+        
+        self.running = True
+        self.event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="journal")
+        self.thread.start()
+        
+    def is_terminated(self):
+        """return True if the last record is complete"""
+        with open(self.journal_path, "rb") as fh:
+            fh.seek(0, os.SEEK_END)
+            if fh.tell() == 0:
+                return True
+            fh.seek(-1, os.SEEK_END)
+            return fh.read(1) == b"\n"
+            
+    def add(self, job):
+        """add a waiting job"""
+        self.append({"op": OP_ADD, "job": job})
+        
+    def remove(self, job_id):
+        """the job is no more waiting"""
+        self.append({"op": OP_DEL, "job-id": job_id})
+        
+    def append(self, record):
+        """add the record in the next batch"""
+        line = json.dumps(record)
+        with self.mutex:
+            self.buffer.append(line)
+            if record["op"] == OP_ADD:
+                self.nb_jobs += 1
+            else:
+                self.nb_jobs = max(0, self.nb_jobs - 1)
+        
+    def run(self):
+        """write the batches"""
+        while self.running:
+            self.event.wait(self.flush_interval)
+            try:
+                self.flush()
+                if self.nb_records > self.compact_min and \
+                        self.nb_records > 2 * self.nb_jobs:
+                    self.compact()
+            except Exception as e:
+                logger.error("journalstorage - unable to write: %s" % e)
+                
+    def flush(self):
+        """write and sync the pending records"""
+        with self.file_mutex:
+            with self.mutex:
+                lines, self.buffer = self.buffer, []
+            if not lines:
+                return
+                
+            self.fh.write("%s\n" % "\n".join(lines))
+            self.fh.flush()
+            os.fsync(self.fh.fileno())
+            self.nb_records += len(lines)
+        
+    def replay(self):
+        """read the journal in one pass, returns the waiting jobs"""
+        jobs = {}
+        nb_records = 0
+        try:
+            with open(self.journal_path, "r") as fh:
+                for line in fh:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # record truncated by a crash
+                        continue
+                    nb_records += 1
+                    if record["op"] == OP_ADD:
+                        jobs[record["job"]["job-id"]] = record["job"]
+                    else:
+                        jobs.pop(record["job-id"], None)
+        except FileNotFoundError:
+            pass
+        return (nb_records, jobs)
+        
+    def load(self):
+        """waiting jobs saved in the journal"""
+        self.flush()
+        with self.file_mutex:
+            nb_records, jobs = self.replay()
+            self.nb_records = nb_records
+            with self.mutex:
+                self.nb_jobs = len(jobs) + len(self.buffer)
+        return list(jobs.values())
+        
+    def compact(self):
+        """rewrite the journal with the waiting jobs only"""
+        logger.debug("journalstorage - compacting journal")
+        
+        self.flush()
+        with self.file_mutex:
+            _, jobs = self.replay()
+            
+            tmp_path = "%s.tmp" % self.journal_path
+            with open(tmp_path, "w") as fh:
+                for job in jobs.values():
+                    fh.write("%s\n" % json.dumps({"op": OP_ADD, "job": job}))
+                fh.flush()
+                os.fsync(fh.fileno())
+                
+            self.fh.close()
+            os.replace(tmp_path, self.journal_path)
+            self.fh = open(self.journal_path, "a")
+            
+            # the rename is durable only when the folder is synced
+            dir_fd = os.open(os.path.dirname(self.journal_path), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+                
+            self.nb_records = len(jobs)
+            with self.mutex:
+                self.nb_jobs = len(jobs) + len(self.buffer)
+                
+        return (constant.OK, "journal compacted")
+        
+    def stop(self):
+        """write the last records and close the journal"""
+        self.running = False
+        self.event.set()
+        self.thread.join()
+        self.flush()
+        self.fh.close()
+        
+RepoJournal = None
+
+def instance():
+    """Returns the singleton"""
+    return RepoJournal
+
+def initialize(repo_path, flush_interval, compact_min):
+    """Instance creation"""
+    global RepoJournal
+    RepoJournal = JournalStorage(repo_path=repo_path,
+                                 flush_interval=flush_interval,
+                                 compact_min=compact_min)
+
+def finalize():
+    """Destruction of the singleton"""
+    global RepoJournal
+    if RepoJournal:
+        RepoJournal.stop()
+        RepoJournal = None
+        
+def add(job):
+    """add a waiting job"""
+    if instance() is not None:
+        instance().add(job=job)
+    
+def remove(job_id):
+    """remove a job"""
+    if instance() is not None:
+        instance().remove(job_id=job_id)
+    
+def load():
+    """load the waiting jobs"""
+    if instance() is None:
+        return []
+    return instance().load()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+import time
+import bisect
+import calendar
+import datetime
+import functools
+
+MONTH_NAMES = ["jan", "feb", "mar", "apr", "may", "jun",
+               "jul", "aug", "sep", "oct", "nov", "dec"]
+DAY_NAMES = ["sun", "mon", "tue", "wed", "thu", "fri", "sat"]
+
+MACROS = {
+            "@yearly": "0 0 1 1 *",
+            "@annually": "0 0 1 1 *",
+            "@monthly": "0 0 1 * *",
+            "@weekly": "0 0 * * 0",
+            "@daily": "0 0 * * *",
+            "@midnight": "0 0 * * *",
+            "@hourly": "0 * * * *"
+         }
+
+# a matching date is always found in this number of years 
+# when the expression is valid (29 february on a given weekday)
+MAX_YEARS = 28
+
+class CronError(Exception):
+    pass
+
+def parse_value(value, names, offset):
+    """parse a number or a name of month/day"""
+    if value.lower() in names:
+        return names.index(value.lower()) + offset
+    if not value.isdigit():
+        raise CronError("invalid value %s" % value)
+    return int(value)
+    
+def parse_field(field, min_value, max_value, names=[], offset=0):
+    """parse one field of the expression, return the sorted list of 
+    allowed values"""
+    values = set()
+    for item in field.split(","):
+        step = 1
+        if "/" in item:
+            item, step = item.split("/", 1)
+            if not step.isdigit() or int(step) == 0:
+                raise CronError("invalid step %s" % step)
+            step = int(step)
+            
+        if item == "*":
+            start, end = min_value, max_value
+        elif "-" in item:
+            start, end = item.split("-", 1)
+            start = parse_value(start, names, offset)
+            end = parse_value(end, names, offset)
+        else:
+            start = parse_value(item, names, offset)
+            # 5/15 means from 5 to the max with a step of 15
+            end = max_value if step > 1 else start
+            
+        if start < min_value or end > max_value or start > end:
+            raise CronError("value out of range in %s" % field)
+        values.update(range(start, end + 1, step))
+        
+    return sorted(values)
+    
+class CronExpression():
+    """compiled cron expression: minute hour day-of-month month 
+    day-of-week"""
+    def __init__(self, expr):
+        """class init"""
+        self.expr = expr
+        
+        fields = MACROS.get(expr.strip().lower(), expr).split()
+        if len(fields) != 5:
+            raise CronError("5 fields are expected in %s" % expr)
+        
+        self.minutes = parse_field(fields[0], 0, 59)
+        self.hours = parse_field(fields[1], 0, 23)
+        self.days = parse_field(fields[2], 1, 31)
+        self.months = parse_field(fields[3], 1, 12,
+                                  names=MONTH_NAMES, offset=1)
+        weekdays = parse_field(fields[4], 0, 7, names=DAY_NAMES)
+        # sunday is 0 or 7
+        self.weekdays = set( [ d % 7 for d in weekdays ] )
+        self.days_set = set(self.days)
+        
+        # when both are restricted, a day matches one or the other
+        self.any_day = fields[2].startswith("*")
+        self.any_weekday = fields[4].startswith("*")
+        
+        if not any( self.match_month(m) for m in self.months ):
+            raise CronError("no matching date for %s" % expr)
+            
+    def match_month(self, month):
+        """check if at least one day of the month can match"""
+        if not self.any_weekday or self.any_day:
+            return True
+        # 29 february exists in leap years
+        _, nb_days = calendar.monthrange(2000, month)
+        return self.days[0] <= nb_days
+        
+    def match_day(self, dt):
+        """check the day of month and the day of week"""
+        # python weekday starts on monday, cron on sunday
+        weekday = (dt.weekday() + 1) % 7
+        day_ok = dt.day in self.days_set
+        weekday_ok = weekday in self.weekdays
+        
+        if self.any_day:
+            return weekday_ok
+        if self.any_weekday:
+            return day_ok
+        return day_ok or weekday_ok
+        
+    def next_day(self, dt):
+        """next matching day in the month of dt, none otherwise"""
+        _, nb_days = calendar.monthrange(dt.year, dt.month)
+        for day in range(dt.day, nb_days + 1):
+            candidate = dt.replace(day=day)
+            if self.match_day(candidate):
+                return candidate
+        return None
+        
+    def get_next(self, timestamp):
+        """next fire timestamp strictly after the timestamp, 
+        computed field by field in local time"""
+        dt = datetime.datetime.fromtimestamp(int(timestamp))
+        dt = dt.replace(second=0) + datetime.timedelta(minutes=1)
+        
+        max_year = dt.year + MAX_YEARS
+        while dt.year <= max_year:
+            if dt.month not in self.months:
+                i = bisect.bisect_left(self.months, dt.month)
+                if i == len(self.months):
+                    dt = datetime.datetime(dt.year + 1, self.months[0], 1)
+                else:
+                    dt = datetime.datetime(dt.year, self.months[i], 1)
+                continue
+                
+            if not self.match_day(dt):
+                next_dt = self.next_day(dt.replace(hour=0, minute=0))
+                if next_dt is None:
+                    if dt.month == 12:
+                        dt = datetime.datetime(dt.year + 1, 1, 1)
+                    else:
+                        dt = datetime.datetime(dt.year, dt.month + 1, 1)
+                else:
+                    dt = next_dt
+                continue
+                
+            if dt.hour not in self.hours:
+                i = bisect.bisect_left(self.hours, dt.hour)
+                if i == len(self.hours):
+                    dt = dt.replace(hour=0, minute=0)
+                    dt += datetime.timedelta(days=1)
+                else:
+                    dt = dt.replace(hour=self.hours[i], minute=0)
+                continue
+                
+            if dt.minute not in self.minutes:
+                i = bisect.bisect_left(self.minutes, dt.minute)
+                if i == len(self.minutes):
+                    dt = dt.replace(minute=0) + datetime.timedelta(hours=1)
+                else:
+                    dt = dt.replace(minute=self.minutes[i])
+                continue
+            
+            # local time, a time skipped by a dst change is shifted
+            # and a repeated time is fired only once
+            next_ts = time.mktime(dt.timetuple())
+            if next_ts > timestamp:
+                return next_ts
+            dt += datetime.timedelta(minutes=1)
+            
+        raise CronError("no matching date for %s" % self.expr)
+        
+@functools.lru_cache(maxsize=1024)
+def get_expression(expr):
+    """compiled expression, shared between all jobs 
+    with the same expression"""
+    return CronExpression(expr)
+    
+def compile_expression(expr):
+    """compile the expression, raise CronError if invalid"""
+    if not isinstance(expr, str):
+        raise CronError("cron expression is expected")
+    return get_expression(expr)
+    
+def get_next(expr, timestamp):
+    """next fire timestamp of the expression"""
+    return compile_expression(expr).get_next(timestamp)
@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+import time
+import threading
+import queue
+import heapq
+import itertools
+import collections
+
+from ea.automateactions.serverengine import constant
+from ea.automateactions.serversystem import logger
+
+class DispatchTask():
+    """task waiting for a worker"""
+    def __init__(self, ref, callback, args, kwargs, flow=None):
+        """class init"""
+        self.ref = ref
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.flow = flow
+        self.dispatch_time = time.time()
+        self.queue_wait = 0
+
+class Flow():
+    """tasks of one workspace, one queue by user, the tasks
+    deferred when the workspace is full are kept in order"""
+    def __init__(self):
+        """class init"""
+        self.users = collections.OrderedDict()
+        self.deferred = collections.deque()
+        self.nb_tasks = 0
+        self.vpass = 0
+        
+class FairQueue(queue.Queue):
+    """queue with weighted fair queuing between the workspaces
+    and round robin between the users of a workspace, the flow of
+    a task is a tuple (workspace, user). The size is limited by 
+    workspace, a workspace can not fill the queue of the others"""
+    def _init(self, maxsize):
+        """init the queue, called by the constructor"""
+        self.flows = {}
+        self.active = []
+        self.vtime = 0
+        self.seq = itertools.count()
+        self.weights = {}
+        self.nb_tasks = 0
+        self.nb_deferred = 0
+        self.stops = collections.deque()
+        
+    def _qsize(self):
+        """number of tasks"""
+        return self.nb_tasks + len(self.stops)
+        
+    def put(self, task, block=True, timeout=None, defer=False):
+        """add the task, never blocks, the tasks of a full workspace
+        are rejected or deferred until a task of the workspace is taken"""
+        with self.not_full:
+            if task is not None and self.maxsize > 0:
+                workspace, _ = task.flow or (None, None)
+                flow = self.flows.get(workspace)
+                if flow is not None and flow.nb_tasks >= self.maxsize:
+                    if not defer:
+                        raise queue.Full
+                    flow.deferred.append(task)
+                    self.nb_deferred += 1
+                    return
+            self._put(task)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+            
+    def _put(self, task):
+        """add the task in the queue of its flow"""
+        # stop the workers when all tasks are executed
+        if task is None:
+            self.stops.append(task)
+            return
+            
+        workspace, user = task.flow or (None, None)
+        flow = self.flows.get(workspace)
+        if flow is None:
+            flow = self.flows[workspace] = Flow()
+            
+        # an idle flow does not keep credit
+        if not flow.nb_tasks:
+            flow.vpass = max(flow.vpass, self.vtime)
+            heapq.heappush(self.active, (flow.vpass, next(self.seq), workspace))
+            
+        flow.users.setdefault(user, collections.deque()).append(task)
+        flow.nb_tasks += 1
+        self.nb_tasks += 1
+        
+    def _get(self):
+        """next task of the flow with the smallest virtual time"""
+        if not self.nb_tasks:
+            return self.stops.popleft()
+            
+        vpass, _, workspace = heapq.heappop(self.active)
+        flow = self.flows[workspace]
+        self.vtime = vpass
+        
+        # the user goes to the end of the round
+        user, tasks = flow.users.popitem(last=False)
+        task = tasks.popleft()
+        if tasks:
+            flow.users[user] = tasks
+        flow.nb_tasks -= 1
+        self.nb_tasks -= 1
+        
+        # the workspace has room for the next deferred task
+        if flow.deferred:
+            flow.users.setdefault(self.get_user(flow.deferred[0]),
+                                  collections.deque()).append(flow.deferred.popleft())
+            flow.nb_tasks += 1
+            self.nb_tasks += 1
+            self.nb_deferred -= 1
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+        
+        flow.vpass = vpass + 1.0 / self.weights.get(workspace, 1)
+        if flow.nb_tasks:
+            heapq.heappush(self.active, (flow.vpass, next(self.seq), workspace))
+        else:
+            del self.flows[workspace]
+        return task
+        
+    def get_user(self, task):
+        """user of the task in its flow"""
+        _, user = task.flow or (None, None)
+        return user
+        
+    def set_weights(self, weights):
+        """weights of the workspaces, 1 by default"""
+        with self.mutex:
+            self.weights = { k: float(v) for k, v in weights.items() if v > 0 }
+            
+    def get_sizes(self):
+        """number of tasks queued and deferred by workspace"""
+        with self.mutex:
+            return { workspace: (flow.nb_tasks, len(flow.deferred))
+                     for workspace, flow in self.flows.items() }
+
+class DispatchPool():
+    """bounded pool of workers with queue support"""
+    def __init__(self, max_workers, max_queue, fair=False):
+        """class init, the tasks are served in order or with
+        fair queuing between workspaces"""
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.fair = fair
+        if self.fair:
+            self.queue = FairQueue(maxsize=max_queue)
+        else:
+            self.queue = queue.Queue(maxsize=max_queue)
+        self.mutex = threading.Lock()
+        self.local = threading.local()
+        self.workers = []
+        
+        # stats
+        self.nb_busy = 0
+        self.nb_submitted = 0
+        self.nb_completed = 0
+        self.nb_rejected = 0
+        self.nb_errors = 0
+        self.wait_total = 0
+        self.wait_max = 0
+        self.flow_stats = {}
+        
+        for i in range(max_workers):
+            t = threading.Thread(target=self.work,
+                                 name="dispatcher-%s" % i)
+            t.start()
+            self.workers.append(t)
+    
+    def is_full(self):
+        """return True if the queue can not accept more tasks,
+        with the fair queuing the queue is limited by workspace"""
+        if self.fair:
+            return False
+        return self.queue.full()
+        
+    def set_weights(self, weights):
+        """weights of the workspaces for the fair queuing"""
+        if self.fair:
+            self.queue.set_weights(weights)
+            
+    def submit(self, ref, callback, *args, flow=None, defer=False, **kwargs):
+        """add a task in the queue, never blocks, with the fair queuing
+        the task is deferred instead of rejected when its workspace is full"""
+        task = DispatchTask(ref, callback, args, kwargs, flow=flow)
+        try:
+            if self.fair:
+                self.queue.put(task, block=False, defer=defer)
+            else:
+                self.queue.put_nowait(task)
+        except queue.Full:
+            logger.error("dispatcher - queue full, task %s rejected" % ref)
+            with self.mutex:
+                self.nb_rejected += 1
+            return (constant.ERROR, "dispatch queue full")
+            
+        with self.mutex:
+            self.nb_submitted += 1
+        return (constant.OK, task)
+        
+    def get_queue_wait(self):
+        """return the queue wait of the task 
+        running in the current worker"""
+        task = getattr(self.local, "task", None)
+        if task is None:
+            return 0
+        return task.queue_wait
+        
+    def work(self):
+        """worker loop"""
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+                
+            task.queue_wait = time.time() - task.dispatch_time
+            with self.mutex:
+                self.nb_busy += 1
+                self.wait_total += task.queue_wait
+                self.wait_max = max(self.wait_max, task.queue_wait)
+                
+                # wait by workspace
+                if task.flow is not None:
+                    stats = self.flow_stats.setdefault(task.flow[0], [0, 0, 0])
+                    stats[0] += 1
+                    stats[1] += task.queue_wait
+                    stats[2] = max(stats[2], task.queue_wait)
+
+            self.local.task = task
+            try:
+                task.callback(*task.args, **task.kwargs)
+            except Exception as e:
+                logger.error("dispatcher - exception while "
+                             "executing task %s: %s" % (task.ref, e))
+                with self.mutex:
+                    self.nb_errors += 1
+            self.local.task = None
+            
+            with self.mutex:
+                self.nb_busy -= 1
+                self.nb_completed += 1
+
+    def get_stats(self):
+        """return stats of the pool"""
+        with self.mutex:
+            nb_started = self.nb_completed + self.nb_busy
+            wait_avg = 0
+            if nb_started:
+                wait_avg = self.wait_total / nb_started
+            stats = {"max-workers": self.max_workers,
+                     "max-queue": self.max_queue,
+                     "busy-workers": self.nb_busy,
+                     "queue-size": self.queue.qsize(),
+                     "submitted": self.nb_submitted,
+                     "completed": self.nb_completed,
+                     "rejected": self.nb_rejected,
+                     "errors": self.nb_errors,
+                     "queue-wait-avg": wait_avg,
+                     "queue-wait-max": self.wait_max}
+                     
+            sizes = {}
+            if self.fair:
+                sizes = self.queue.get_sizes()
+                stats["deferred"] = self.queue.nb_deferred
+            workspaces = {}
+            for workspace in set(self.flow_stats) | set(sizes):
+                # tasks submitted without flow
+                if workspace is None:
+                    continue
+                nb, total, wait_max = self.flow_stats.get(workspace, [0, 0, 0])
+                queue_size, nb_deferred = sizes.get(workspace, (0, 0))
+                workspaces[workspace] = {"queue-size": queue_size,
+                                         "deferred": nb_deferred,
+                                         "dispatched": nb,
+                                         "queue-wait-avg": total / nb if nb else 0,
+                                         "queue-wait-max": wait_max}
+            if workspaces:
+                stats["workspaces"] = workspaces
+            return stats
+                    
+    def stop(self):
+        """stop all workers, pending tasks are executed before"""
+        logger.debug("dispatcher - stopping workers")
+        for _ in self.workers:
+            self.queue.put(None)
+        for t in self.workers:
+            t.join()
+
+Dispatch = None
+
+def initialize(max_workers, max_queue, fair=False):
+    """init the dispatcher"""
+    global Dispatch
+    if Dispatch is None:
+        Dispatch = DispatchPool(max_workers=max_workers,
+                                max_queue=max_queue,
+                                fair=fair)
+        
+def finalize():
+    """stop the dispatcher"""
+    global Dispatch
+    if Dispatch:
+        Dispatch.stop()
+        Dispatch = None
+        
+def instance():
+    """dispatcher instance"""
+    global Dispatch
+    return Dispatch
+    
+def submit(ref, callback, *args, flow=None, defer=False, **kwargs):
+    """submit task"""
+    return instance().submit(ref, callback, *args, flow=flow, defer=defer, **kwargs)
+    
+def set_weights(weights):
+    """weights of the workspaces"""
+    instance().set_weights(weights)
+    
+def get_queue_wait():
+    """queue wait of the current task"""
+    if instance() is None:
+        return 0
+    return instance().get_queue_wait()
+    
+def get_stats():
+    """dispatcher stats"""
+    return instance().get_stats()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+import json
+import bisect
+import threading
+
+from ea.automateactions.serversystem import logger
+
+METRIC_DISPATCH_LAG = "dispatch-lag"
+METRIC_START_LATENCY = "start-latency"
+METRIC_BUILD_TIME = "build-time"
+
+# upper bounds of the buckets in seconds, the last bucket is unbounded
+BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 
+           1, 2.5, 5, 10, 30, 60, 300]
+
+class Histogram():
+    """histogram of durations with fixed buckets"""
+    def __init__(self):
+        """class init"""
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        
+    def observe(self, value):
+        """add a value"""
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        
+    def get_percentile(self, percent):
+        """upper bound of the bucket containing the percentile"""
+        rank = self.count * percent / 100
+        nb = 0
+        for i, count in enumerate(self.counts):
+            nb += count
+            if count and nb >= rank:
+                if i < len(BUCKETS):
+                    return min(BUCKETS[i], self.max)
+                break
+        return self.max
+        
+    def get_stats(self):
+        """summary of the histogram"""
+        stats = {"count": self.count,
+                 "avg": self.total / self.count if self.count else 0,
+                 "max": self.max,
+                 "p50": self.get_percentile(50),
+                 "p90": self.get_percentile(90),
+                 "p99": self.get_percentile(99)}
+        buckets = {}
+        for i, count in enumerate(self.counts):
+            le = "%s" % BUCKETS[i] if i < len(BUCKETS) else "+inf"
+            buckets[le] = count
+        stats["buckets"] = buckets
+        return stats
+        
+class MetricsThread(threading.Thread):
+    """collect the metrics and write them periodically in the log"""
+    def __init__(self, log_interval):
+        """class init"""
+        threading.Thread.__init__(self, name="metrics", daemon=True)
+        self.log_interval = log_interval
+        self.mutex = threading.Lock()
+        self.event = threading.Event()
+        self.histograms = {}
+        for name in [METRIC_DISPATCH_LAG, METRIC_START_LATENCY, 
+                     METRIC_BUILD_TIME]:
+            self.histograms[name] = Histogram()
+        self.sources = {}
+        
+    def observe(self, name, value):
+        """add a value to the histogram"""
+        with self.mutex:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(max(value, 0))
+            
+    def register(self, name, get_stats):
+        """add the stats of a component to the metrics"""
+        self.sources[name] = get_stats
+        
+    def get_stats(self, buckets=True):
+        """all metrics"""
+        stats = {}
+        with self.mutex:
+            for name, histogram in self.histograms.items():
+                stats[name] = histogram.get_stats()
+                if not buckets:
+                    del stats[name]["buckets"]
+                    
+        for name, get_stats in self.sources.items():
+            try:
+                stats[name] = get_stats()
+            except Exception as e:
+                logger.error("metrics - unable to get "
+                             "stats of %s: %s" % (name, e))
+        return stats
+        
+    def run(self):
+        """write the metrics in the log"""
+        while not self.event.wait(self.log_interval):
+            logger.info("metrics - %s" % json.dumps(self.get_stats(buckets=False)))
+            
+    def stop(self):
+        """stop the thread"""
+        self.event.set()
+        
+Metrics = None
+
+def initialize(log_interval):
+    """init the metrics, not written in the log with an interval of zero"""
+    global Metrics
+    if Metrics is None:
+        Metrics = MetricsThread(log_interval=log_interval)
+        if log_interval > 0:
+            Metrics.start()
+        
+def finalize():
+    """stop the metrics"""
+    global Metrics
+    if Metrics:
+        Metrics.stop()
+        if Metrics.is_alive():
+            Metrics.join()
+        Metrics = None
+        
+def instance():
+    """metrics instance"""
+    global Metrics
+    return Metrics
+    
+def observe(name, value):
+    """add a value, ignored when the metrics are not enabled"""
+    if instance() is not None:
+        instance().observe(name, value)
+        
+def register(name, get_stats):
+    """add the stats of a component"""
+    instance().register(name, get_stats)
+    
+def get_stats():
+    """all metrics"""
+    return instance().get_stats()
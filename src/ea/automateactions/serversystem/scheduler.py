@@ -22,38 +22,224 @@
 # -------------------------------------------------------------------
 
 
+
 import time
+import zlib
 import threading
 import heapq
+import itertools
 
 from ea.automateactions.serverengine import constant
 from ea.automateactions.serversystem import logger
+from ea.automateactions.serversystem import dispatcher
+from ea.automateactions.serversystem import metrics
+
+ENGINE_HEAP = "heap"
+ENGINE_INDEXED = "indexed"
+
+# minimum number of cancelled entries before compacting the indexed heap
+COMPACT_MIN = 1024
+
+# delay in seconds before retrying when the dispatch queue is full
+DISPATCH_RETRY = 0.1
+
+# maximum sleep in seconds, the wall clock is checked at least 
+# at this interval
+MAX_SLEEP = 1.0
+
+# difference in seconds between the wall clock and the monotonic
+# clock considered as a jump of the wall clock
+JUMP_THRESHOLD = 0.5
 
+# policies for the runs of recursive jobs missed during a downtime
+# or a jump of the wall clock
+CATCH_UP_ALL = "run-all"
+CATCH_UP_ONCE = "run-once"
+CATCH_UP_SKIP = "skip"
+CATCH_UP_POLICIES = [CATCH_UP_ALL, CATCH_UP_ONCE, CATCH_UP_SKIP]
+
+def get_slot(key, window):
+    """deterministic offset in seconds of the key in the spread window,
+    the same key is always placed in the same slot"""
+    if window <= 0:
+        return 0
+    return zlib.crc32(key.encode("utf-8")) % int(window)
+    
+def run_event(event):
+    """run the callback of the event, the lag between the expected 
+    time and the start of the callback is measured"""
+    metrics.observe(metrics.METRIC_DISPATCH_LAG, time.time() - event.timestamp)
+    event.callback(*event.args, **(event.kwargs or {}))
+    
 class SchedulerEvent():
     """Scheduler event"""
-    def __init__(self, ref, callback, timestamp, args, kwargs):
-        """class event"""
+    __slots__ = ("ref", "callback", "timestamp", "args", "kwargs", "entry",
+                 "flow", "fire_time")
+    
+    def __init__(self, ref, callback, timestamp, args, kwargs, flow=None):
+        """class event, no dict is kept without keyword arguments"""
         self.ref = ref
+        self.flow = flow
         self.callback = callback
         self.timestamp = timestamp
         self.args = args
-        self.kwargs = kwargs
+        self.kwargs = kwargs or None
+        self.entry = None
+        
+        # wall clock time when the event is found due by the scheduler
+        self.fire_time = None
+        
     def __lt__(self, other):
         """less-than comparison"""
         return self.timestamp < other.timestamp
-        
+
+class HeapQueue():
+    """binary heap of events, cancel and reschedule in O(n)"""
+    def __init__(self):
+        """init the queue"""
+        self.heap = []
+
+    def __len__(self):
+        """number of events in the queue"""
+        return len(self.heap)
+
+    def push(self, event):
+        """add event"""
+        heapq.heappush(self.heap, event)
+
+    def remove(self, event):
+        """remove event"""
+        self.heap.remove(event)
+        heapq.heapify(self.heap)
+
+    def update(self, event, timestamp):
+        """update the timestamp of the event"""
+        self.remove(event)
+        event.timestamp = timestamp
+        self.push(event)
+
+    def peek(self):
+        """return the next event without removing it"""
+        if self.heap:
+            return self.heap[0]
+        return None
+
+    def pop(self):
+        """remove and return the next event"""
+        return heapq.heappop(self.heap)
+
+class IndexedQueue():
+    """binary heap of events with lazy deletion, 
+    insert and reschedule in O(log n), cancel in O(1)"""
+    def __init__(self):
+        """init the queue"""
+        self.heap = []
+        self.counter = itertools.count()
+        self.nb_cancelled = 0
+
+    def __len__(self):
+        """number of events in the queue"""
+        return len(self.heap) - self.nb_cancelled
+
+    def push(self, event):
+        """add event"""
+        # the sequence number keeps the order of insertion
+        # for events with the same timestamp
+        event.entry = [event.timestamp, next(self.counter), event]
+        heapq.heappush(self.heap, event.entry)
+
+    def remove(self, event):
+        """remove event, the entry is only marked as cancelled"""
+        if event.entry is None:
+            raise ValueError("event not in queue")
+        event.entry[-1] = None
+        event.entry = None
+        self.nb_cancelled += 1
+
+        # too many dead entries in the heap, time to rebuild it
+        if self.nb_cancelled > COMPACT_MIN and \
+            self.nb_cancelled > len(self.heap) // 2:
+            self.compact()
+
+    def update(self, event, timestamp):
+        """update the timestamp of the event"""
+        self.remove(event)
+        event.timestamp = timestamp
+        self.push(event)
+
+    def compact(self):
+        """remove cancelled entries from the heap"""
+        self.heap = [e for e in self.heap if e[-1] is not None]
+        heapq.heapify(self.heap)
+        self.nb_cancelled = 0
+
+    def peek(self):
+        """return the next event without removing it"""
+        heap = self.heap
+        while heap and heap[0][-1] is None:
+            heapq.heappop(heap)
+            self.nb_cancelled -= 1
+        if heap:
+            return heap[0][-1]
+        return None
+
+    def pop(self):
+        """remove and return the next event"""
+        event = self.peek()
+        if event is None:
+            raise IndexError("pop from empty queue")
+        heapq.heappop(self.heap)
+        event.entry = None
+        return event
+
+ENGINES = {
+            ENGINE_HEAP: HeapQueue,
+            ENGINE_INDEXED: IndexedQueue
+          }
+
 class SchedulerThread(threading.Thread):
     """scheduler thread with queue support"""
-    def __init__(self):
-        """scheduler class"""
+    def __init__(self, engine=ENGINE_HEAP, max_sleep=MAX_SLEEP):
+        """scheduler class, events are dated with the wall clock,
+        the scheduler sleeps at most max sleep seconds on the monotonic 
+        clock and compares the next event with the wall clock on wake up"""
         threading.Thread.__init__(self)
         self.event = threading.Event()
         self.mutex = threading.RLock()
-        self.queue = []
+        if engine not in ENGINES:
+            raise Exception("unknown scheduler engine: %s" % engine)
+        self.queue = ENGINES[engine]()
         self.running = True
         self.expire = None
+        self.max_sleep = max_sleep
+        
+        # offset between the wall clock and the monotonic clock,
+        # only used to detect the jumps of the wall clock
+        self.anchor = time.time() - time.monotonic()
+        self.nb_jumps = 0
+        self.last_jump = 0
         
-    def add_event(self, ref, timestamp, callback, *args, **kwargs):
+    def check_clock(self):
+        """detect a jump of the wall clock (ntp step, resume of the vm)
+        with the change of the offset to the monotonic clock, the jump 
+        is counted only, the events are compared with the wall clock 
+        polled every max sleep seconds"""
+        anchor = time.time() - time.monotonic()
+        jump = anchor - self.anchor
+        if abs(jump) > JUMP_THRESHOLD:
+            logger.info("scheduler - wall clock jump of %.3fs detected" % jump)
+            self.nb_jumps += 1
+            self.last_jump = jump
+        self.anchor = anchor
+        
+    def get_deadline(self):
+        """monotonic deadline of the next wake up, 
+        limited by the max sleep to detect the jumps of the clock"""
+        if self.expire is None:
+            return time.monotonic() + self.max_sleep
+        return time.monotonic() + max(0, min(self.expire, self.max_sleep))
+        
+    def add_event(self, ref, timestamp, callback, *args, flow=None, **kwargs):
         """add event in the queue"""
         self.mutex.acquire()
         success = constant.OK
@@ -66,8 +252,9 @@ class SchedulerThread(threading.Thread):
             new_event = SchedulerEvent(ref, callback, 
                                        timestamp,
                                        args,
-                                       kwargs)
-            heapq.heappush(self.queue, new_event )
+                                       kwargs,
+                                       flow=flow)
+            self.queue.push(new_event)
             
             # activate the event
             self.event.set()
@@ -82,10 +269,9 @@ class SchedulerThread(threading.Thread):
         """remove event from queue"""
         self.mutex.acquire()
         try:
-            if self.queue:
+            if len(self.queue):
                 logger.debug("scheduler - remove event")
                 self.queue.remove(event)
-                heapq.heapify(self.queue)
                 del event
         except Exception as e:
             logger.error("scheduler - exception while "
@@ -96,15 +282,9 @@ class SchedulerThread(threading.Thread):
         """update event timestamp"""
         self.mutex.acquire()
         try:
-            if self.queue:
-                logging.info("update event")
-                # remove event from the queue
-                self.queue.remove(event)
-                heapq.heapify(self.queue)
-
-                # update the timestamp of the event
-                event.timestamp = timestamp
-                heapq.heappush(self.queue, event)
+            if len(self.queue):
+                logger.debug("scheduler - update event")
+                self.queue.update(event, timestamp)
                 
                 self.event.set()
         except Exception as e:
@@ -120,39 +300,80 @@ class SchedulerThread(threading.Thread):
         self.event.set()
         self.mutex.release()
         
+    def get_stats(self):
+        """queue size and next fire time"""
+        with self.mutex:
+            stats = {"queue-size": len(self.queue),
+                     "next-fire": None,
+                     "next-fire-in": None,
+                     "clock-jumps": self.nb_jumps,
+                     "last-clock-jump": self.last_jump}
+            next_event = self.queue.peek()
+            if next_event is not None:
+                stats["next-fire"] = next_event.timestamp
+                stats["next-fire-in"] = next_event.timestamp - time.time()
+            return stats
+                    
+    def dispatch(self, event):
+        """execute the callback of the event in the dispatcher
+        or in a dedicated thread if the dispatcher is not enabled,
+        the event waits in its flow when the flow is full"""
+        try:
+            if dispatcher.instance() is not None:
+                dispatcher.submit(event.ref, run_event, event,
+                                  flow=event.flow, defer=True)
+            else:
+                t = threading.Thread(target=run_event, args=(event,))
+                t.start()
+        except Exception as e:
+            logger.error("scheduler - exception while "
+                         "executing event %s: %s" % (event.ref, e))
+                         
     def run(self):
         """run thread loop"""
         q = self.queue
         while self.running:
-            # block until the event is set or timeout occurs
-            self.event.wait(self.expire)
+            # block until the event is set or the deadline is reached
+            deadline = self.get_deadline()
+            self.event.wait(deadline - time.monotonic())
             if self.running:
                 self.mutex.acquire()
-                if q:
+                self.check_clock()
+                next_event = q.peek()
+                
+                # time when the event is found due, the wait for
+                # a free place in the dispatcher is not counted
+                if next_event is not None and next_event.fire_time is None \
+                        and time.time() >= next_event.timestamp:
+                    next_event.fire_time = time.time()
+                    
+                if next_event is not None:
                     # time to run event ?
-                    if (time.time() - q[0].timestamp) < 0:
+                    if (time.time() - next_event.timestamp) < 0:
                         # too early, update next wake up
-                        self.expire = q[0].timestamp - time.time()
+                        self.expire = next_event.timestamp - time.time()
+                        self.event.clear()
+                        
+                    # dispatch queue is full, keep the event in the 
+                    # scheduler and retry a bit later, never with
+                    # the fair queuing where the events are deferred
+                    elif dispatcher.instance() is not None and \
+                            dispatcher.instance().is_full():
+                        self.expire = DISPATCH_RETRY
                         self.event.clear()
                         
                     else:
-                        logger.debug("scheduler - running event %s" % q[0].ref)
-                        try:
-                            t = threading.Thread(target=q[0].callback,
-                                                 args=q[0].args,
-                                                 kwargs=q[0].kwargs)
-                            t.start()
-                        except Exception as e:
-                            logger.error("scheduler - exception while "
-                                         "executing event %s: %s" % (q[0].ref, e))
+                        logger.debug("scheduler - running event %s" % next_event.ref)
+                        self.dispatch(next_event)
                         
                         # remove event from queue
-                        heapq.heappop(q)
+                        q.pop()
                         
                         # queue is empty ?
-                        if q:
+                        next_event = q.peek()
+                        if next_event is not None:
                             # update next wake up
-                            self.expire = q[0].timestamp - time.time()
+                            self.expire = next_event.timestamp - time.time()
                             self.event.clear()
                         else:
                             # no more event, go to sleep
@@ -163,11 +384,11 @@ class SchedulerThread(threading.Thread):
 
 Sched = None
 
-def initialize():
+def initialize(engine=ENGINE_HEAP, max_sleep=MAX_SLEEP):
     """init the scheduler"""
     global Sched
     if Sched is None:
-        Sched = SchedulerThread()
+        Sched = SchedulerThread(engine=engine, max_sleep=max_sleep)
         Sched.start()
         
 def finalize():
@@ -176,21 +397,25 @@ def finalize():
     if Sched:
         Sched.stop()
         Sched.join()
-        del Sched
+        Sched = None
         
 def instance():
     """scheduler instance"""
     global Sched
     return Sched
     
-def add_event(ref, timestamp, callback, *args, **kwargs):
-    """add event"""
-    return instance().add_event(ref, timestamp, callback, *args, **kwargs)
+def add_event(ref, timestamp, callback, *args, flow=None, **kwargs):
+    """add event, the flow is used for the fair queuing in the dispatcher"""
+    return instance().add_event(ref, timestamp, callback, *args, flow=flow, **kwargs)
     
 def remove_event(event):
     """remove event"""
     instance().remove_event(event)
     
-def update_event(event):
+def update_event(event, timestamp):
     """update event"""
-    instance().update_event(event)
\ No newline at end of file
+    instance().update_event(event, timestamp)
+    
+def get_stats():
+    """scheduler stats"""
+    return instance().get_stats()
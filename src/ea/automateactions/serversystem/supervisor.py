@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2020 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+
+import os
+import time
+import asyncio
+import threading
+import concurrent.futures
+
+from ea.automateactions.serversystem import logger
+
+# size of the error output kept for each process
+MAX_OUTPUT = 65536
+
+# threads running the exit callbacks, out of the loop
+EXIT_WORKERS = 4
+
+WATCHER_PIDFD = "pidfd"
+WATCHER_POLL = "poll"
+
+def get_retcode(status):
+    """convert a wait status to a return code like subprocess"""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+    
+def get_resources(rusage):
+    """resources used by a terminated process"""
+    return {"cpu-user": rusage.ru_utime,
+            "cpu-system": rusage.ru_stime,
+            "max-rss": rusage.ru_maxrss,
+            "block-in": rusage.ru_inblock,
+            "block-out": rusage.ru_oublock,
+            "ctx-voluntary": rusage.ru_nvcsw,
+            "ctx-involuntary": rusage.ru_nivcsw}
+            
+class SupervisedProcess():
+    """child process tracked by the supervisor"""
+    def __init__(self, proc, on_exit):
+        """class init"""
+        self.proc = proc
+        self.pid = proc.pid
+        self.on_exit = on_exit
+        self.start_time = time.time()
+        self.pidfd = None
+        self.err_fd = None
+        self.output = bytearray()
+        
+class ProcessSupervisor():
+    """one event loop waiting all the child processes and 
+    draining their outputs, without a thread per process"""
+    def __init__(self, poll_interval):
+        """class init"""
+        self.poll_interval = poll_interval
+        self.procs = {}
+        self.watcher = WATCHER_POLL
+        if hasattr(os, "pidfd_open"):
+            self.watcher = WATCHER_PIDFD
+        self.polling = False
+        
+        # stats
+        self.nb_started = 0
+        self.nb_exited = 0
+        
+        # the end of the jobs is handled with disk io, 
+        # the loop only collects the exit status
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=EXIT_WORKERS,
+                                                              thread_name_prefix="supervisor-exit")
+        
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run,
+                                       name="supervisor")
+        self.thread.start()
+        
+    def run(self):
+        """run the event loop"""
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        self.loop.close()
+        
+    def watch_process(self, proc, on_exit):
+        """track a process started with the error output as pipe,
+        on_exit is called from the loop with the return code, the 
+        duration, the resources used and the error output"""
+        sp = SupervisedProcess(proc=proc, on_exit=on_exit)
+        self.loop.call_soon_threadsafe(self.add_process, sp)
+        
+    def call_later(self, delay, callback):
+        """call the function from the loop after the delay"""
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay,
+                                       self.run_callback, callback)
+        
+    def run_callback(self, callback):
+        """run a delayed call"""
+        try:
+            callback()
+        except Exception as e:
+            logger.error("supervisor - delayed call error: %s" % e)
+            
+    def call_exit(self, on_exit, *args):
+        """call the exit callback from the executor, from the loop only"""
+        self.loop.run_in_executor(self.executor, self.run_exit, on_exit, *args)
+        
+    def run_exit(self, on_exit, *args):
+        """run an exit callback"""
+        try:
+            on_exit(*args)
+        except Exception as e:
+            logger.error("supervisor - exit callback error: %s" % e)
+            
+    def watch_stream(self, fd, on_data):
+        """call on_data from the loop with the bytes read on 
+        the descriptor, empty bytes at the end of the stream"""
+        self.loop.call_soon_threadsafe(self.add_stream, fd, on_data)
+        
+    def unwatch_stream(self, fd):
+        """stop to read the descriptor, from the loop only"""
+        self.loop.remove_reader(fd)
+        
+    def add_stream(self, fd, on_data):
+        """register the reader of the stream"""
+        os.set_blocking(fd, False)
+        self.loop.add_reader(fd, self.read_stream, fd, on_data)
+        
+    def read_stream(self, fd, on_data):
+        """descriptor ready to read"""
+        try:
+            data = os.read(fd, MAX_OUTPUT)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.loop.remove_reader(fd)
+        
+        try:
+            on_data(data)
+        except Exception as e:
+            logger.error("supervisor - stream callback error: %s" % e)
+            
+    def add_process(self, sp):
+        """start to supervise the process"""
+        self.procs[sp.pid] = sp
+        self.nb_started += 1
+        
+        if sp.proc.stderr is not None:
+            sp.err_fd = sp.proc.stderr.fileno()
+            os.set_blocking(sp.err_fd, False)
+            self.loop.add_reader(sp.err_fd, self.read_output, sp)
+            
+        if self.watcher == WATCHER_PIDFD:
+            try:
+                sp.pidfd = os.pidfd_open(sp.pid)
+            except OSError as e:
+                logger.error("supervisor - pidfd not supported, "
+                             "fallback to polling: %s" % e)
+                self.watcher = WATCHER_POLL
+            else:
+                self.loop.add_reader(sp.pidfd, self.reap, sp)
+                
+        if self.watcher == WATCHER_POLL and not self.polling:
+            self.polling = True
+            self.loop.call_soon(self.poll)
+    
+    def read_output(self, sp):
+        """read the error output of the process, returns 
+        False when nothing has been read"""
+        try:
+            data = os.read(sp.err_fd, MAX_OUTPUT)
+        except BlockingIOError:
+            return False
+        except OSError:
+            data = b""
+            
+        if not data:
+            self.loop.remove_reader(sp.err_fd)
+            sp.proc.stderr.close()
+            sp.err_fd = None
+            return False
+            
+        # keep only the end of the output
+        sp.output += data
+        if len(sp.output) > MAX_OUTPUT:
+            del sp.output[:-MAX_OUTPUT]
+        return True
+        
+    def poll(self):
+        """check the processes without pidfd"""
+        for sp in list(self.procs.values()):
+            if sp.pidfd is None:
+                self.reap(sp)
+        self.loop.call_later(self.poll_interval, self.poll)
+        
+    def reap(self, sp):
+        """collect the exit status and the resources usage"""
+        if sp.pid not in self.procs:
+            return
+            
+        # the exit status is unknown if the process 
+        # has been waited elsewhere, the job is failed
+        retcode = None
+        resources = None
+        err_str = ""
+        try:
+            pid, status, rusage = os.wait4(sp.pid, os.WNOHANG)
+        except ChildProcessError as e:
+            logger.error("supervisor - unable to wait %s: %s" % (sp.pid, e))
+            err_str = "exit status of the process lost"
+        else:
+            if pid == 0:
+                return
+            retcode = get_retcode(status)
+            resources = get_resources(rusage)
+            
+        del self.procs[sp.pid]
+        self.nb_exited += 1
+        
+        if sp.pidfd is not None:
+            self.loop.remove_reader(sp.pidfd)
+            os.close(sp.pidfd)
+            
+        # the remaining output, without to wait a grandchild
+        # keeping the pipe opened
+        if sp.err_fd is not None:
+            while self.read_output(sp):
+                pass
+            if sp.err_fd is not None:
+                self.loop.remove_reader(sp.err_fd)
+                sp.proc.stderr.close()
+                
+        sp.proc.returncode = retcode
+        duration = time.time() - sp.start_time
+        
+        output = sp.output.decode("utf8", errors="replace")
+        err_str = "\n".join(e for e in (err_str, output) if e)
+        self.call_exit(sp.on_exit, retcode, duration, resources, err_str)
+        
+    def get_stats(self):
+        """return stats of the supervisor"""
+        return {"watcher": self.watcher,
+                "running": len(self.procs),
+                "started": self.nb_started,
+                "exited": self.nb_exited}
+                
+    def stop(self):
+        """stop the event loop, processes are no more supervised"""
+        logger.debug("supervisor - stopping event loop")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.executor.shutdown(wait=True)
+        
+Supervisor = None
+
+def initialize(poll_interval):
+    """init the supervisor"""
+    global Supervisor
+    if Supervisor is None:
+        Supervisor = ProcessSupervisor(poll_interval=poll_interval)
+        
+def finalize():
+    """stop the supervisor"""
+    global Supervisor
+    if Supervisor:
+        Supervisor.stop()
+        Supervisor = None
+        
+def instance():
+    """supervisor instance"""
+    return Supervisor
+    
+def watch_process(proc, on_exit):
+    """supervise the process"""
+    instance().watch_process(proc=proc, on_exit=on_exit)
+    
+def call_later(delay, callback):
+    """delayed call from the loop"""
+    instance().call_later(delay=delay, callback=callback)
+    
+def call_exit(on_exit, *args):
+    """exit callback out of the loop"""
+    instance().call_exit(on_exit, *args)
+    
+def watch_stream(fd, on_data):
+    """read the stream from the loop"""
+    instance().watch_stream(fd=fd, on_data=on_data)
+    
+def unwatch_stream(fd):
+    """stop to read the stream"""
+    instance().unwatch_stream(fd=fd)
+    
+def get_stats():
+    """supervisor stats"""
+    return instance().get_stats()